@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+# Compares the memory and the throughput of yamc.utils.Map and yamc.utils.Record
+# on items of the shape that collectors pass to writers.
+# usage: python bin/benchmark-record.py [count]
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from yamc.utils import Map, Record
+
+
+def payload(i):
+    return {
+        "time": 1700000000 + i,
+        "temperature": 21.5,
+        "humidity": 40,
+        "device": {"id": "sensor-%d" % (i % 10), "battery": 98, "linkquality": 120},
+    }
+
+
+def create(cls, count):
+    return [
+        cls(collector_id="c1", data=cls(payload(i)), writer_config={"measurement": "m"})
+        for i in range(count)
+    ]
+
+
+def access(items):
+    s = 0
+    for item in items:
+        s += item.data.temperature + item.data.device.battery
+    return s
+
+
+def measure(cls, count):
+    t = time.perf_counter()
+    items = create(cls, count)
+    create_time = time.perf_counter() - t
+    t = time.perf_counter()
+    access(items)
+    access_time = time.perf_counter() - t
+    del items
+    tracemalloc.start()
+    # the items are kept until the traced memory is read
+    items = create(cls, count)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return create_time, access_time, size
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("items: %d" % count)
+    print("%-8s %14s %14s %14s" % ("type", "create [ms]", "access [ms]", "memory [KB]"))
+    for cls in (Map, Record):
+        create_time, access_time, size = measure(cls, count)
+        print(
+            "%-8s %14.1f %14.1f %14.1f"
+            % (cls.__name__, create_time * 1000, access_time * 1000, size / 1024)
+        )
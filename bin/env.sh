@@ -12,6 +12,7 @@ else
   # plugins 
   export PYTHONPATH=$PYTHONPATH:$mdir/yamc/plugins/yamc-mqtt
   export PYTHONPATH=$PYTHONPATH:$mdir/yamc/plugins/yamc-pushover
+  #export PYTHONPATH=$PYTHONPATH:$mdir/yamc/plugins/yamc-parquet
   #export PYTHONPATH=$PYTHONPATH:$mdir/dms-collector
   #export PYTHONPATH=$PYTHONPATH:$mdir/yamc/plugins/yamc-oracle
 fi
@@ -11,7 +11,7 @@ import paho.mqtt.client as mqtt
 
 from yamc.providers import EventProvider, Event
 from yamc import WorkerComponent
-from yamc.utils import Map
+from yamc.utils import Record
 
 
 class MQTTProvider(EventProvider, WorkerComponent):
@@ -52,7 +52,9 @@ class MQTTProvider(EventProvider, WorkerComponent):
             self.log.info(f"Received on_message for topic {topic}")
             event = self.select_one(topic)
             if event:
-                data = Map(json.loads(str(message.payload.decode("utf-8"))))
+                data = json.loads(
+                    str(message.payload.decode("utf-8")), object_hook=Record
+                )
                 self.log.debug("The data is: " + str(data))
                 event.update(data)
         except Exception as e:
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .writers import ParquetWriter
+
+__version__ = "1.0.0"
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .parquet import ParquetWriter
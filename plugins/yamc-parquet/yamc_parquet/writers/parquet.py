@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import time
+import glob
+import json
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from datetime import datetime
+from yamc.writers import Writer, HealthCheckException
+from yamc.writers.backlog import SegmentLog
+
+# multipliers of time values in seconds to the units of timestamps
+TIME_UNITS = {"s": 1, "ms": 1000, "us": 1000000, "ns": 1000000000}
+
+# the file with the journal offsets of the rows in closed files of each collector
+CLOSED_FILE = "closed.json"
+
+
+class ParquetArchive:
+    """
+    Parquet files of a single collector. Rows are converted to the columnar format when they are
+    appended and buffered to row groups of `row_group_size` rows that are written to the open file.
+    The file is written with the `.tmp` suffix and renamed when it is closed so that readers only
+    see complete files. The offsets of the rows in the writer's journal are tracked so that the
+    journal can be trimmed when the rows are in a closed file.
+    """
+
+    def __init__(self, writer, collector_id):
+        self.writer = writer
+        self.collector_id = collector_id
+        self.dir = os.path.join(writer.dir, collector_id)
+        self.tables = []
+        self.count = 0
+        self.first_time = None
+        self.schema = None
+        self.file = None
+        self.path = None
+        self.open_time = 0
+        self.file_rows = 0
+        # journal offsets of the first buffered row, of the first row in the open file,
+        # after the last row in the open file and after the last appended row
+        self.buffer_offset = None
+        self.file_offset = None
+        self.file_end = None
+        self.end_offset = writer.closed.get(collector_id, 0)
+        for tmp in glob.glob(os.path.join(glob.escape(self.dir), "*.parquet.tmp")):
+            # the rows of the file that was not closed are recovered from the journal
+            writer.log.warning(
+                "The file %s was not closed, its rows will be written again." % tmp
+            )
+            os.remove(tmp)
+
+    @property
+    def pending_offset(self):
+        """
+        The journal offset of the first row that is not in a closed file or None.
+        """
+        return self.file_offset if self.file_offset is not None else self.buffer_offset
+
+    def create_schema(self, rows):
+        """
+        Creates the schema from the declared types and the types of values in the rows; columns
+        of unknown types are stored as strings.
+        """
+        schema = pa.Table.from_pylist(rows).schema
+        fields = []
+        for field in schema:
+            if field.name in self.writer.types:
+                field = field.with_type(self.writer.types[field.name])
+            elif pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields)
+
+    def to_table(self, rows):
+        """
+        Converts the rows to a table, it fails when the rows do not match the schema.
+        """
+        schema = self.schema if self.schema is not None else self.create_schema(rows)
+        table = pa.Table.from_pylist(rows, schema=schema)
+        self.schema = schema
+        return table
+
+    def open(self):
+        os.makedirs(self.dir, exist_ok=True)
+        self.path = os.path.join(
+            self.dir,
+            "%s-%s-%d.parquet"
+            % (
+                self.collector_id,
+                datetime.now().strftime("%Y%m%d-%H%M%S"),
+                self.buffer_offset,
+            ),
+        )
+        self.file = pq.ParquetWriter(
+            self.path + ".tmp",
+            self.schema,
+            compression=self.writer.compression,
+            compression_level=self.writer.compression_level,
+        )
+        self.open_time = time.time()
+        self.file_rows = 0
+
+    def rotate(self):
+        """
+        Closes the file when it has `max_file_rows` rows or is older than `rotate_interval` seconds.
+        """
+        if self.file is not None and (
+            self.file_rows >= self.writer.max_file_rows
+            or time.time() - self.open_time >= self.writer.rotate_interval
+        ):
+            self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            os.replace(self.path + ".tmp", self.path)
+            self.writer.log.debug(
+                "The file %s was closed with %d rows." % (self.path, self.file_rows)
+            )
+            self.file = None
+            self.file_offset = None
+            self.writer.file_closed(self)
+
+    def append(self, table, offset, end_offset=None):
+        """
+        Adds the table with rows at the journal `offset` to the buffer, `end_offset` is the offset
+        after the last row when the rows are not consecutive in the journal.
+        """
+        if self.count == 0:
+            self.first_time = time.time()
+            self.buffer_offset = offset
+        self.tables.append(table)
+        self.count += len(table)
+        self.end_offset = end_offset if end_offset is not None else offset + len(table)
+
+    def flush(self, force=False):
+        """
+        Writes the buffered rows as a row group when the row group is full, when the rows waited
+        for `flush_interval` seconds or when `force` is set.
+        """
+        if self.count == 0 or (
+            not force
+            and self.count < self.writer.row_group_size
+            and time.time() - self.first_time < self.writer.flush_interval
+        ):
+            return
+        self.rotate()
+        if self.file is None:
+            self.open()
+        self.file.write_table(pa.concat_tables(self.tables), row_group_size=self.count)
+        if self.file_offset is None:
+            self.file_offset = self.buffer_offset
+        self.file_end = self.end_offset
+        self.file_rows += self.count
+        self.tables, self.count, self.buffer_offset = [], 0, None
+
+
+class ParquetWriter(Writer):
+    """
+    Writer of the fields of writer's items to Parquet files with typed columns. Items of each
+    collector are stored in files in the collector's directory; the `time` column holds the
+    time of the item when it is not one of the fields. Time values are in seconds and are
+    converted to the unit of the time column's timestamp type.
+
+    Rows are written to the journal before they are buffered; the journal is trimmed when the
+    rows are in closed files, and the rows that are not in closed files are recovered from the
+    journal when the writer starts. The buffered rows are flushed and the files are rotated in
+    the background so that the files of idle collectors are closed.
+    """
+
+    def __init__(self, config, component_id):
+        super().__init__(config, component_id)
+        self.dir = self.config.get_dir_path(
+            self.config.value_str(
+                "dir", default=config.data_dir + "/parquet/" + component_id
+            ),
+            check=False,
+        )
+        self.row_group_size = self.config.value_int(
+            "row_group_size", default=10000, min=1
+        )
+        self.flush_interval = self.config.value_int("flush_interval", default=60)
+        self.rotate_interval = self.config.value_int("rotate_interval", default=3600)
+        self.max_file_rows = self.config.value_int(
+            "max_file_rows", default=1000000, min=1
+        )
+        self.compression = self.config.value_str("compression", default="zstd")
+        self.compression_level = self.config.value_int(
+            "compression_level", default=None
+        )
+        self.time_column = self.config.value_str("time_column", default="time")
+        self.types = {
+            k: pa.type_for_alias(v)
+            for k, v in self.config.value("types", default={}, required=False).items()
+        }
+        self.types.setdefault(self.time_column, pa.timestamp("ms"))
+        time_type = self.types[self.time_column]
+        self.time_multiplier = (
+            TIME_UNITS[time_type.unit] if pa.types.is_timestamp(time_type) else None
+        )
+        self.archives = {}
+        # the interval of flushing and rotating the files in the background
+        self.maintain_interval = max(
+            1, min(self.flush_interval, self.rotate_interval, 60)
+        )
+        self.lock = threading.Lock()
+        self.journal = SegmentLog(
+            os.path.join(self.dir, ".journal"),
+            fsync=self.config.value_str("fsync", default="interval"),
+            block_items=max(1, self.batch_size),
+            log=self.log,
+        )
+        self.closed = self.read_closed()
+        self.recover()
+
+    def read_closed(self):
+        try:
+            with open(os.path.join(self.journal.log_dir, CLOSED_FILE), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def write_closed(self):
+        file = os.path.join(self.journal.log_dir, CLOSED_FILE)
+        with open(file + ".tmp", "w") as f:
+            json.dump(self.closed, f)
+        os.replace(file + ".tmp", file)
+
+    def archive(self, collector_id):
+        archive = self.archives.get(collector_id)
+        if archive is None:
+            archive = self.archives[collector_id] = ParquetArchive(self, collector_id)
+        return archive
+
+    def recover(self):
+        """
+        Buffers the rows from the journal that are not in closed files.
+        """
+        offset = self.journal.committed
+        while offset < self.journal.end_offset:
+            offset, entries = self.journal.read(self.row_group_size, offset=offset)
+            start = offset - len(entries)
+            # the journal offsets of the first and after the last row and the rows of archives
+            groups = {}
+            for i, entry in enumerate(entries):
+                archive = self.archive(entry.collector_id)
+                if start + i >= archive.end_offset:
+                    group = groups.get(archive)
+                    if group is None:
+                        group = groups[archive] = [start + i, start + i, []]
+                    group[1] = start + i + 1
+                    group[2].append(entry.row)
+            for archive, (first, end, rows) in groups.items():
+                archive.append(archive.to_table(rows), first, end)
+        recovered = sum([a.count for a in self.archives.values()])
+        if recovered > 0:
+            self.log.info("Recovered %d rows from the journal." % recovered)
+
+    def file_closed(self, archive):
+        """
+        Records the rows of the closed file and trims the journal.
+        """
+        self.closed[archive.collector_id] = archive.file_end
+        self.write_closed()
+        pending = [
+            a.pending_offset
+            for a in self.archives.values()
+            if a.pending_offset is not None
+        ]
+        self.journal.commit(
+            min(pending) if len(pending) > 0 else self.journal.end_offset
+        )
+
+    def healthcheck(self):
+        """
+        Checks that the files can be written to the directory and flushes the buffered rows.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        if not os.access(self.dir, os.W_OK | os.X_OK):
+            raise Exception("The directory %s is not writable!" % self.dir)
+        with self.lock:
+            for archive in self.archives.values():
+                archive.flush()
+
+    def maintain(self):
+        """
+        Flushes the buffered rows that waited for `flush_interval` seconds and rotates the files.
+        """
+        with self.lock:
+            try:
+                for archive in self.archives.values():
+                    archive.flush()
+                    archive.rotate()
+            except Exception as e:
+                self.log.error(
+                    "Writing the Parquet file failed, the rows remain buffered: %s"
+                    % str(e)
+                )
+                self._is_healthy = False
+
+    def maintainer(self, exit_event):
+        while not exit_event.wait(self.maintain_interval):
+            self.maintain()
+
+    def worker(self, exit_event):
+        threading.Thread(
+            target=self.maintainer, args=(exit_event,), daemon=True
+        ).start()
+        super().worker(exit_event)
+
+    def destroy(self):
+        super().destroy()
+        with self.lock:
+            for archive in self.archives.values():
+                try:
+                    archive.flush(force=True)
+                    archive.close()
+                except Exception as e:
+                    self.log.error(
+                        "Cannot write the rows of the collector %s, the rows remain in the journal: %s"
+                        % (archive.collector_id, str(e))
+                    )
+            self.journal.close()
+
+    def create_row(self, data):
+        row = dict(data.writer_config.fields)
+        t = row.get(self.time_column, data.data.get("time", time.time()))
+        if self.time_multiplier is not None and isinstance(t, (int, float)):
+            t = int(t * self.time_multiplier)
+        row[self.time_column] = t
+        return row
+
+    def do_write(self, items):
+        groups = {}
+        for data in items:
+            groups.setdefault(data.collector_id, []).append(self.create_row(data))
+        with self.lock:
+            # rows that do not match the schema fail the batch before it is journaled
+            tables = [
+                (self.archive(collector_id), self.archive(collector_id).to_table(rows))
+                for collector_id, rows in groups.items()
+            ]
+            try:
+                offset = self.journal.append(
+                    [
+                        dict(collector_id=collector_id, row=row)
+                        for collector_id, rows in groups.items()
+                        for row in rows
+                    ]
+                )
+            except OSError as e:
+                raise HealthCheckException("Writing to the journal failed!", e)
+            for archive, table in tables:
+                archive.append(table, offset)
+                offset += len(table)
+            # the rows are in the journal, the rows that cannot be written remain buffered
+            try:
+                for archive in self.archives.values():
+                    archive.flush()
+            except Exception as e:
+                self.log.error(
+                    "Writing the Parquet file failed, the rows remain buffered: %s"
+                    % str(e)
+                )
+                self._is_healthy = False
@@ -10,7 +10,7 @@ import requests
 import socket
 
 from yamc.writers import Writer, HealthCheckException
-from yamc.utils import Map, deep_eval
+from yamc.utils import Map, Record, deep_eval
 
 
 class PushoverWriter(Writer):
@@ -45,7 +45,7 @@ class PushoverWriter(Writer):
             if not item.collector_id in collectors.keys():
                 collectors[item.collector_id] = []
             collectors[item.collector_id].append(
-                Map(data=item.data, writer_config=item.writer_config)
+                Record(data=item.data, writer_config=item.writer_config)
             )
         return collectors.items()
 
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import argparse
+import pytest
+
+from yamc.config import ConfigPart
+
+
+class ComponentConfig:
+    """
+    Configuration of components created in tests. The `raw_config` holds the properties of
+    `providers`, `writers` and `collectors` as in the yaml file; the data directory is the test's
+    temporary directory.
+    """
+
+    def __init__(self, raw_config, data_dir):
+        self.raw_config = raw_config
+        self.config_dir = data_dir
+        self.data_dir = data_dir
+        self.custom_functions = None
+        self.args = argparse.Namespace(test=False, debug=False, trace=False)
+        self.config = ConfigPart(self, None, raw_config, data_dir)
+
+    def get_dir_path(self, path, base_dir=None, check=False):
+        return self.config.get_dir_path(path, base_dir, check)
+
+    def part(self, name, component_id):
+        return ConfigPart(
+            self, "%s.%s" % (name, component_id), self.raw_config, self.config_dir
+        )
+
+    def provider(self, provider_id):
+        return self.part("providers", provider_id)
+
+    def writer(self, writer_id):
+        return self.part("writers", writer_id)
+
+    def collector(self, collector_id):
+        return self.part("collectors", collector_id)
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """
+    Returns a function that creates the configuration of components from keyword arguments
+    such as `providers={"p": {...}}`.
+    """
+
+    def _make_config(**raw_config):
+        return ComponentConfig(raw_config, str(tmp_path))
+
+    return _make_config
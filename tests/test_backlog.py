@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import marshal
+import pytest
+
+from yamc.utils import Record
+from yamc.writers.backlog import (
+    SegmentLog,
+    BlockCodec,
+    FORMAT_MARSHAL,
+    COMPRESSION_NONE,
+    lz4,
+)
+
+
+def items(count, start=0):
+    return [
+        Record(
+            collector_id="c%d" % (i % 3),
+            data=Record(time=i, value=i * 1.5, tags=("a", i)),
+            writer_config=Record(fields=Record(v=i, s="x" * (i % 5))),
+        )
+        for i in range(start, start + count)
+    ]
+
+
+def read_all(log, batch=7):
+    result = []
+    while log.size() > 0:
+        offset, batch_items = log.read(batch)
+        result += batch_items
+        log.commit(offset)
+    return result
+
+
+@pytest.mark.parametrize("format", ["compact", "pickle"])
+@pytest.mark.parametrize("compression", ["none", "zlib", "lz4"])
+def test_codec_roundtrip(format, compression):
+    if compression == "lz4" and lz4 is None:
+        pytest.skip("the lz4 package is not installed")
+    codec = BlockCodec(format=format, compression=compression)
+    data = items(20) + [Record(collector_id="x", data={1: None, "b": b"\x00"})]
+    assert codec.decode(*codec.encode(data)) == data
+
+
+def test_codec_reads_marshal_blocks():
+    shapes, shape_ids = [], {}
+    data = items(5)
+    packed = [BlockCodec.pack(x, shapes, shape_ids) for x in data]
+    payload = marshal.dumps((shapes, packed), 4)
+    codec = BlockCodec()
+    assert codec.decode(FORMAT_MARSHAL | (COMPRESSION_NONE << 4), payload) == data
+    with pytest.raises(Exception, match="another Python version"):
+        codec.decode(FORMAT_MARSHAL, b"\xff" + payload)
+
+
+def test_append_read_commit(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=2048, fsync="never", block_items=10)
+    assert log.append(items(50)) == 0
+    assert log.append(items(50, 50)) == 50
+    offset, first = log.read(15)
+    assert offset == 15 and first == items(15)
+    # reading does not consume the items until they are committed
+    assert log.read(15)[1] == first
+    log.commit(offset)
+    assert log.size() == 85
+    assert read_all(log) == items(85, 15)
+    assert log.append(items(1, 100)) == 100
+
+
+def test_reopen_keeps_committed_offset(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=2048, fsync="never", block_items=10)
+    log.append(items(100))
+    log.commit(log.read(30)[0])
+    log.close()
+    log = SegmentLog(str(tmp_path), segment_size=2048, fsync="never", block_items=10)
+    assert log.committed == 30
+    assert read_all(log) == items(70, 30)
+
+
+def test_segments_do_not_exceed_segment_size(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=4096, fsync="never", block_items=10)
+    log.append(items(500))
+    log.append(items(3, 500))
+    assert len(log.segments) > 1
+    assert all([s.size <= 4096 for s in log.segments])
+    assert [os.path.getsize(s.path) for s in log.segments] == [
+        s.size for s in log.segments
+    ]
+    assert read_all(log) == items(503)
+
+
+def test_consumed_segments_are_deleted(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_size=4096, fsync="never", block_items=10)
+    log.append(items(500))
+    segments = len(log.segments)
+    log.commit(250)
+    assert 0 < len(log.segments) < segments
+    assert read_all(log) == items(250, 250)
+    assert len(log.segments) == 0
+
+
+def test_incomplete_block_is_truncated(tmp_path):
+    log = SegmentLog(str(tmp_path), fsync="never", block_items=10)
+    log.append(items(30))
+    log.close()
+    path = log.segments[-1].path
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+    os.remove(os.path.join(str(tmp_path), "index"))
+    log = SegmentLog(str(tmp_path), fsync="never", block_items=10)
+    assert log.size() == 20
+    assert log.append(items(5, 20)) == 20
+    assert read_all(log) == items(25)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import threading
+
+from yamc.writers.writer import BatchQueue
+
+
+def keyed_queue(capacity=100):
+    return BatchQueue(capacity, capacity, 0, key=lambda x: x[0])
+
+
+def test_batch_size_and_order():
+    queue = BatchQueue(100, 80, 50)
+    for i in range(25):
+        queue.put(i)
+    assert queue.get_batch(10, 10) == list(range(10))
+    assert queue.get_batch(10, 10) == list(range(10, 20))
+
+
+def test_linger_releases_partial_batch():
+    queue = BatchQueue(100, 80, 50)
+    queue.put(1)
+    start = time.time()
+    assert queue.get_batch(10, 0.2) == [1]
+    assert 0.15 <= time.time() - start < 1
+
+
+def test_empty_batch_when_idle():
+    queue = BatchQueue(100, 80, 50)
+    start = time.time()
+    assert queue.get_batch(10, 0.2) == []
+    assert time.time() - start < 1
+
+
+def test_empty_batch_on_exit():
+    queue = BatchQueue(100, 80, 50)
+    exit_event = threading.Event()
+    exit_event.set()
+    queue.put(1)
+    assert queue.get_batch(10, 10, exit_event) == []
+
+
+def test_backpressure_watermarks():
+    queue = BatchQueue(10, 4, 2)
+    assert all([queue.put(i) for i in range(4)])
+    assert not queue.put(4)
+    assert queue.get_batch(1, 0) == [0]
+    assert not queue.put(4)
+    assert queue.get_batch(1, 0) == [1]
+    assert queue.put(4)
+
+
+def test_keys_in_flight_are_not_released():
+    queue = keyed_queue()
+    for item in [("a", 1), ("b", 1), ("a", 2), ("c", 1), ("a", 3)]:
+        queue.put(item)
+    first = queue.get_batch(2, 0)
+    assert first == [("a", 1), ("b", 1)]
+    # the items of a and b wait until the first batch is released
+    assert queue.get_batch(10, 0) == [("c", 1)]
+    assert queue.get_batch(10, 0) == []
+    queue.put(("b", 2))
+    queue.release(first)
+    assert queue.get_batch(10, 0) == [("a", 2), ("a", 3), ("b", 2)]
+
+
+def test_available_count_with_keys_in_flight():
+    queue = keyed_queue(20000)
+    for i in range(10000):
+        queue.put(("a" if i % 2 == 0 else "b", i))
+    batch = queue.get_batch(1, 0)
+    assert queue._available()[0] == 5000
+    queue.release(batch)
+    assert queue._available()[0] == 9999
+    assert queue.get_batch(10000, 0) == [
+        ("a" if i % 2 == 0 else "b", i) for i in range(1, 10000)
+    ]
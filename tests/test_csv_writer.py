@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import csv
+import gzip
+import glob
+import time
+
+from datetime import datetime
+from yamc.utils import Record
+from yamc.writers.csv_writer import CsvFile, CsvWriter, FileTasks, PartitionIndex
+
+
+def read_csv(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="") as f:
+        return list(csv.reader(f))
+
+
+def write_file(path, rows, **options):
+    tasks = FileTasks()
+    csv_file = CsvFile(path, tasks=tasks, **options)
+    csv_file.write(rows)
+    csv_file.close()
+    tasks.close()
+    return csv_file
+
+
+def test_header_and_columns(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write_file(path, [{"a": 1, "b": "x"}, {"b": "y", "a": 2, "c": 3}])
+    write_file(path, [{"a": 3}], columns=["a", "b"], has_header=True)
+    assert read_csv(path) == [["a", "b"], ["1", "x"], ["2", "y"], ["3", ""]]
+
+
+def test_columns_from_header(tmp_path):
+    path = str(tmp_path / "data.csv")
+    write_file(path, [{"b": 1, "a": 2}])
+    write_file(path, [{"a": 3, "b": 4}], has_header=True)
+    assert read_csv(path) == [["b", "a"], ["1", "2"], ["4", "3"]]
+
+
+def test_existing_file_without_header(tmp_path):
+    path = str(tmp_path / "data.csv")
+    with open(path, "w") as f:
+        f.write("1,2\n")
+    write_file(path, [{"a": 3, "b": 4}])
+    assert read_csv(path) == [["1", "2"], ["3", "4"]]
+
+
+def test_values_are_quoted(tmp_path):
+    path = str(tmp_path / "data.csv")
+    values = ["a,b", 'say "x"', "line\nbreak", "carriage\rreturn", ""]
+    write_file(path, [{str(i): v for i, v in enumerate(values)}], header=False)
+    assert read_csv(path) == [values]
+
+
+def test_rotation_by_size(tmp_path):
+    path = str(tmp_path / "data.csv")
+    tasks = FileTasks()
+    csv_file = CsvFile(path, max_bytes=100, backup_count=2, tasks=tasks)
+    for i in range(5):
+        csv_file.write([{"v": "%d" % i + "x" * 100}])
+    csv_file.close()
+    tasks.close()
+    assert sorted(os.listdir(str(tmp_path))) == ["data.csv", "data.csv.1", "data.csv.2"]
+    assert [read_csv(path + s)[1][0][0] for s in ["", ".1", ".2"]] == ["4", "3", "2"]
+
+
+def test_rotation_interval_continues_after_reopen(tmp_path):
+    path = str(tmp_path / "data.csv")
+    opened = []
+    first = write_file(
+        path, [{"v": 1}], rotate_interval=60, opened=lambda *x: opened.append(x)
+    )
+    assert opened == [(path, first.open_time, True)]
+    second = write_file(
+        path, [{"v": 2}], rotate_interval=60, open_time=first.open_time - 120
+    )
+    # the file was older than the rotation interval when it was reopened
+    assert os.path.exists(path + ".1")
+    assert second.open_time > first.open_time
+
+
+def test_partition_index(tmp_path):
+    index = PartitionIndex(str(tmp_path / "index.json"))
+    path = str(tmp_path / "c" / "p.csv")
+    index.update(path, 10, 20, 2)
+    index.update(path, 5, 15, 3, opened=1, header=True)
+    index.save()
+    entry = PartitionIndex(str(tmp_path / "index.json")).get(path)
+    assert entry == dict(min_time=5, max_time=20, rows=5, opened=1, header=True)
+
+
+def test_partitions_are_compressed(make_config, tmp_path):
+    config = make_config(
+        writers={
+            "csv": dict(path="csv/{collector_id}/{time:%Y-%m-%d}.csv", close_after=0)
+        }
+    )
+    writer = CsvWriter(config, "csv")
+    t = time.time()
+    for i in range(3):
+        writer.do_write(
+            [
+                Record(
+                    collector_id="c",
+                    data={"time": t + i},
+                    writer_config=Record(fields={"v": i}),
+                )
+            ]
+        )
+    writer.destroy()
+    path = str(tmp_path / "csv" / "c" / datetime.fromtimestamp(t).strftime("%Y-%m-%d"))
+    assert glob.glob(path + "*") == [path + ".csv.gz"]
+    assert read_csv(path + ".csv.gz") == [["v"], ["0"], ["1"], ["2"]]
+    entry = writer.index.get(path + ".csv")
+    assert entry["rows"] == 3 and entry["compressed"]
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import json
+import pytest
+
+from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+from yamc.utils import Record
+from yamc.writers import HealthCheckException
+from yamc.writers.influxdb import LineEncoder, InfluxDBWriter
+
+
+def test_encode_fields():
+    encoder = LineEncoder("s")
+    lines = encoder.encode(
+        [
+            ("cpu load", {"host": "a,b", "empty": ""}, {"v": 1, "ok": True}, 10),
+            ("cpu load", {"host": "a,b"}, {"s": 'x "y"\n', "f": 1.5}, 20),
+        ]
+    )
+    assert lines == [
+        "cpu\\ load,host=a\\,b v=1i,ok=true 10",
+        'cpu\\ load,host=a\\,b s="x \\"y\\"\\n",f=1.5 20',
+    ]
+
+
+def test_encode_skips_points_without_fields():
+    assert LineEncoder().encode([("m", {}, {"v": None}, 1)]) == []
+
+
+@pytest.mark.parametrize(
+    "precision, t, expected",
+    [("s", 10, 10), ("ms", 1.5, 1500), ("ms", "1.5", 1500), ("n", "2", 2000000000)],
+)
+def test_timestamp(precision, t, expected):
+    assert LineEncoder(precision).timestamp(t) == expected
+
+
+def test_encode_numpy_scalars():
+    np = pytest.importorskip("numpy")
+    encoder = LineEncoder()
+    assert encoder.field(np.int64(3)) == "3i"
+    assert encoder.field(np.uint8(200)) == "200i"
+    assert encoder.field(np.float32(0.5)) == "0.5"
+    assert encoder.field(np.bool_(True)) == "true"
+
+
+class FakeClient:
+    """
+    Client that fails the writes of points for which `error` returns an error.
+    """
+
+    def __init__(self, error):
+        self.error = error
+        self.written = []
+
+    def write_points(self, data, time_precision=None, protocol=None):
+        e = self.error(data)
+        if e is not None:
+            raise e
+        self.written.extend(data)
+
+
+def create_writer(make_config, error, **properties):
+    config = make_config(
+        writers={
+            "influxdb": dict(
+                host="localhost", port=8086, dbname="yamc", batch_size=10, **properties
+            )
+        }
+    )
+    writer = InfluxDBWriter(config, "influxdb")
+    writer.client = FakeClient(error)
+    return writer
+
+
+def client_error(code, message):
+    return InfluxDBClientError(json.dumps({"error": message}), code)
+
+
+def items(*points):
+    return [
+        Record(
+            collector_id="c",
+            data={"time": t},
+            writer_config=Record(measurement=m, fields=fields),
+        )
+        for m, fields, t in points
+    ]
+
+
+def quarantine(writer):
+    with open(writer.quarantine_file) as f:
+        return [line for line in f.read().splitlines() if not line.startswith("#")]
+
+
+def test_field_conflict_quarantines_named_points(make_config):
+    written = []
+
+    def error(data):
+        # InfluxDB writes the points without the conflict in a partial write
+        written.extend([x for x in data if 'v="x"' not in x])
+        if any(['v="x"' in x for x in data]):
+            return client_error(
+                400,
+                'partial write: field type conflict: input field "v" on measurement "cpu" '
+                "is type string, already exists as type integer dropped=1",
+            )
+
+    writer = create_writer(make_config, error)
+    writer.do_write(
+        items(("cpu", {"v": 1}, 1), ("cpu", {"v": "x"}, 2), ("mem", {"v": 2}, 3))
+    )
+    assert set(written) == {"cpu v=1i 1", "mem v=2i 3"}
+    assert quarantine(writer) == ['cpu v="x" 2']
+
+
+def test_batch_error_is_not_bisected(make_config):
+    calls = []
+
+    def error(data):
+        calls.append(len(data))
+        return client_error(400, "retention policy not found: autogen")
+
+    writer = create_writer(make_config, error)
+    writer.do_write(items(("cpu", {"v": 1}, 1), ("cpu", {"v": 2}, 2)))
+    assert calls == [2]
+    assert quarantine(writer) == ["cpu v=1i 1", "cpu v=2i 2"]
+
+
+@pytest.mark.parametrize("protocol", ["line", "json"])
+def test_permanent_error_is_not_retried(make_config, protocol):
+    writer = create_writer(
+        make_config,
+        lambda data: client_error(404, "database not found: yamc"),
+        protocol=protocol,
+    )
+    with pytest.raises(Exception) as e:
+        writer.do_write(items(("cpu", {"v": 1}, 1)))
+    assert not isinstance(e.value, HealthCheckException)
+    assert quarantine(writer) == ["cpu v=1i 1"]
+
+
+def test_server_error_is_retried(make_config):
+    writer = create_writer(
+        make_config, lambda data: InfluxDBServerError("service unavailable")
+    )
+    with pytest.raises(HealthCheckException):
+        writer.do_write(items(("cpu", {"v": 1}, 1)))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import glob
+import time
+import pytest
+
+from yamc.utils import Record
+
+pytest.importorskip("pyarrow")
+yamc_parquet = pytest.importorskip("yamc_parquet")
+
+import pyarrow.parquet as pq
+
+
+def create_writer(make_config, **properties):
+    config = make_config(
+        writers={"parquet": dict(dir="parquet", row_group_size=10, **properties)}
+    )
+    return yamc_parquet.ParquetWriter(config, "parquet")
+
+
+def items(collector_id, count, start=0):
+    return [
+        Record(
+            collector_id=collector_id,
+            data={"time": 1700000000 + start + i},
+            writer_config=Record(fields={"value": start + i}),
+        )
+        for i in range(count)
+    ]
+
+
+def read_rows(writer):
+    files = glob.glob(os.path.join(writer.dir, "*", "*.parquet"))
+    return sorted(
+        sum([pq.read_table(f).column("value").to_pylist() for f in files], [])
+    )
+
+
+def test_time_is_scaled_to_the_column_unit(make_config):
+    writer = create_writer(make_config, types={"time": "timestamp[ms]"})
+    writer.do_write(items("c", 10))
+    writer.destroy()
+    files = glob.glob(os.path.join(writer.dir, "c", "*.parquet"))
+    t = pq.read_table(files[0]).column("time").to_pylist()[0]
+    assert t.timestamp() == 1700000000
+
+
+def test_idle_files_are_closed(make_config):
+    writer = create_writer(make_config, flush_interval=1, rotate_interval=1)
+    writer.do_write(items("c", 5))
+    assert read_rows(writer) == []
+    time.sleep(1.1)
+    writer.maintain()
+    time.sleep(1.1)
+    writer.maintain()
+    assert glob.glob(os.path.join(writer.dir, "c", "*.tmp")) == []
+    assert read_rows(writer) == list(range(5))
+    assert writer.journal.size() == 0
+    writer.destroy()
+
+
+def test_rows_are_recovered_from_journal(make_config):
+    writer = create_writer(make_config, max_file_rows=20)
+    for i in range(5):
+        writer.do_write(items("a", 10, i * 10) + items("b", 3, 100 + i * 3))
+    # the writer ends without closing the files
+    writer.journal.close()
+    writer = create_writer(make_config, max_file_rows=20)
+    writer.destroy()
+    assert read_rows(writer) == list(range(50)) + list(range(100, 115))
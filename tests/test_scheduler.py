@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import threading
+import pytest
+
+from yamc.utils import Map
+from yamc.collectors.scheduler import Scheduler, WorkerPool
+
+
+class Job:
+    """
+    Job that runs every `interval` seconds for `duration` seconds or until `release` is set.
+    """
+
+    def __init__(
+        self,
+        component_id,
+        interval,
+        duration=0,
+        overrun="skip",
+        max_concurrent=1,
+        timeout=None,
+        release=None,
+    ):
+        self.component_id = component_id
+        self.interval = interval
+        self.duration = duration
+        self.overrun = overrun
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.release = release
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.ended = 0
+        self.stats = Map(
+            runs=0,
+            failures=0,
+            skipped=0,
+            coalesced=0,
+            timeouts=0,
+            last_duration=None,
+            max_duration=0,
+            last_lag=None,
+            max_lag=0,
+        )
+
+    def next_run(self, now):
+        return now + self.interval
+
+    def run(self, run):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        if self.release is not None:
+            self.release.wait()
+        else:
+            time.sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+            self.ended += 1
+
+
+@pytest.fixture
+def schedule():
+    """
+    Returns a function that runs the jobs in a scheduler for the number of seconds.
+    """
+    exit_event = threading.Event()
+    releases = []
+
+    def _schedule(jobs, seconds, pool_size=4):
+        scheduler = Scheduler(pool_size=pool_size)
+        for job in jobs:
+            scheduler.add(job)
+            if job.release is not None:
+                releases.append(job.release)
+        scheduler.start(exit_event)
+        time.sleep(seconds)
+        return scheduler
+
+    yield _schedule
+    exit_event.set()
+    for release in releases:
+        release.set()
+
+
+def test_skip_overrun(schedule):
+    job = Job("skip", 0.1, duration=0.35)
+    schedule([job], 1.2)
+    assert job.max_running == 1
+    assert job.stats.skipped > 0
+    assert job.stats.coalesced == 0
+
+
+def test_coalesce_overrun(schedule):
+    job = Job("coalesce", 0.1, duration=0.35, overrun="coalesce")
+    schedule([job], 1.2)
+    assert job.max_running == 1
+    assert job.stats.coalesced > 0
+    # the coalesced run starts when the previous run ends
+    assert job.ended >= 3
+
+
+def test_concurrent_overrun(schedule):
+    job = Job("concurrent", 0.1, duration=0.45, overrun="concurrent", max_concurrent=2)
+    schedule([job], 1.2)
+    assert job.max_running == 2
+    assert job.stats.skipped > 0
+
+
+def test_timed_out_runs_do_not_starve_pool(schedule):
+    hung = [
+        Job("hung%d" % i, 0.1, timeout=0.2, release=threading.Event()) for i in range(2)
+    ]
+    healthy = Job("healthy", 0.2, duration=0.1)
+    schedule(hung + [healthy], 2, pool_size=2)
+    assert all([job.stats.timeouts == 1 for job in hung])
+    # the hung jobs are not dispatched again while their runs did not end
+    assert all([job.stats.skipped > 0 for job in hung])
+    assert healthy.ended >= 5
+
+
+def test_pool_replaces_abandoned_threads():
+    pool = WorkerPool(2)
+    pool.start()
+    release, threads, ended = threading.Event(), [], []
+
+    def hang():
+        threads.append(threading.current_thread())
+        release.wait()
+
+    pool.submit(hang)
+    pool.submit(hang)
+    time.sleep(0.1)
+    for thread in threads:
+        pool.abandon(thread)
+    start = time.time()
+    for i in range(2):
+        pool.submit(lambda: (time.sleep(0.3), ended.append(time.time() - start)))
+    time.sleep(0.5)
+    # the tasks ran concurrently in the replacement threads
+    assert len(ended) == 2 and max(ended) < 0.45
+    release.set()
+    time.sleep(0.1)
+    assert pool.threads == 2 and len(pool.abandoned) == 0
+    pool.shutdown()
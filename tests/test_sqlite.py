@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import sqlite3
+import pytest
+
+from yamc.utils import Record
+from yamc.writers import SqliteWriter
+
+
+def create_writer(make_config, **properties):
+    return SqliteWriter(make_config(writers={"sqlite": properties}), "sqlite")
+
+
+def item(collector_id, t, **fields):
+    return Record(
+        collector_id=collector_id, data={"time": t}, writer_config=Record(fields=fields)
+    )
+
+
+def rows(writer, table):
+    return writer.conn.execute('SELECT * FROM "%s" ORDER BY time' % table).fetchall()
+
+
+def test_table_names_do_not_collide(make_config):
+    writer = create_writer(make_config)
+    names = [writer.table_name(c) for c in ["a.b", "a-b", "a_b"]]
+    assert len(set(names)) == 3
+    assert names[2] == "a_b"
+    writer.do_write([item(c, 1, v=i) for i, c in enumerate(["a.b", "a-b", "a_b"])])
+    assert [rows(writer, n) for n in names] == [[(1, 0)], [(1, 1)], [(1, 2)]]
+    writer.destroy()
+
+
+def test_new_columns_are_added(make_config):
+    writer = create_writer(make_config)
+    writer.do_write([item("c", 1, a=1), item("c", 2, a=2, b="x")])
+    writer.do_write([item("c", 3, b="y")])
+    assert rows(writer, "c") == [(1, 1, None), (2, 2, "x"), (3, None, "y")]
+    writer.destroy()
+
+
+def test_prune_only_writer_tables(make_config):
+    writer = create_writer(make_config, retention=10)
+    writer.conn.execute("CREATE TABLE other (time REAL, v INTEGER)")
+    writer.conn.execute("INSERT INTO other VALUES (0, 1)")
+    now = time.time()
+    writer.do_write([item("c", now - 100, v=1), item("c", now, v=2)])
+    writer.prune()
+    assert [r[1] for r in rows(writer, "c")] == [2]
+    assert rows(writer, "other") == [(0, 1)]
+    with pytest.raises(Exception, match="not created by the writer"):
+        writer.do_write([item("other", now, v=1)])
+    writer.destroy()
+
+
+def test_values_are_converted(make_config):
+    np = pytest.importorskip("numpy")
+    writer = create_writer(make_config)
+    writer.do_write(
+        [
+            item(
+                "c",
+                np.float64(1.5),
+                i=np.int64(3),
+                b=np.bool_(True),
+                big=2**70,
+                d={"x": np.int32(1)},
+            )
+        ]
+    )
+    assert rows(writer, "c") == [(1.5, 3, 1, str(2**70), '{"x": 1}')]
+    writer.destroy()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import threading
+
+from yamc.utils import Record
+from yamc.writers import Writer
+from yamc.writers.writer import HealthCheckException
+
+
+class FailingWriter(Writer):
+    """
+    Writer that fails with the writer's problem until `failures` attempts are made.
+    """
+
+    def __init__(self, config, component_id):
+        super().__init__(config, component_id)
+        self.failures = 0
+        self.attempts = 0
+        self.written = []
+
+    def do_write(self, items):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise HealthCheckException("The destination is not available!")
+        self.written.extend(items)
+
+
+class ListWriter(Writer):
+    """
+    Writer that stores the written items in a list.
+    """
+
+    def __init__(self, config, component_id):
+        super().__init__(config, component_id)
+        self.written = []
+
+    def do_write(self, items):
+        self.written.extend(items)
+
+
+def create_writer(make_config, **properties):
+    config = make_config(writers={"list": dict(batch_size=10, **properties)})
+    return ListWriter(config, "list")
+
+
+def item(i):
+    return Record(collector_id="c", data={"time": i}, writer_config=Record(fields={}))
+
+
+def wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.05)
+    return condition()
+
+
+def test_backlog_is_replayed_when_idle(make_config):
+    writer = create_writer(make_config, linger=0.2)
+    writer.backlog.put([item(i) for i in range(30)])
+    exit_event = threading.Event()
+    writer.start(exit_event)
+    try:
+        assert wait_for(lambda: writer.backlog.size() == 0)
+        assert [x.data["time"] for x in writer.written] == list(range(30))
+    finally:
+        exit_event.set()
+        writer.join()
+        writer.destroy()
+
+
+def test_spilled_items_are_written_to_backlog_in_blocks(make_config):
+    writer = create_writer(make_config)
+    blocks = []
+    put = writer.backlog.put
+    writer.backlog.put = lambda items: (blocks.append(len(items)), put(items))
+    # the writer does not check its health again during the test
+    writer._is_healthy = False
+    writer.last_healthcheck = time.time()
+    assert not any(
+        [writer.write("c", {"time": i}, Record(fields={})) for i in range(25)]
+    )
+    assert blocks == [10, 10]
+    writer.flush_spilled()
+    assert blocks == [10, 10, 5]
+    assert writer.backlog.size() == 25
+    writer.destroy()
+
+
+def failing_writer(make_config, failures, **retry):
+    retry = dict(dict(initial_delay=0, max_delay=0), **retry)
+    config = make_config(writers={"fail": dict(batch_size=10, retry=retry)})
+    writer = FailingWriter(config, "fail")
+    writer.failures = failures
+    writer._is_healthy = True
+    writer.last_healthcheck = time.time()
+    return writer
+
+
+def take_batch(writer, count):
+    for i in range(count):
+        writer.queue.put(item(i))
+    return writer.queue.get_batch(count, 0)
+
+
+def test_failed_batch_is_retried(make_config):
+    writer = failing_writer(make_config, failures=2, max_attempts=3)
+    writer.write_batch(take_batch(writer, 5))
+    for attempt in [1, 2]:
+        t, a, batch = writer.next_retry()
+        assert a == attempt and len(batch) == 5
+        writer.write_batch(batch, a)
+    assert writer.next_retry() is None
+    assert [x.data["time"] for x in writer.written] == list(range(5))
+    assert writer.is_healthy() and writer.backlog.size() == 0
+    assert writer.queue.qsize() == 0
+    writer.destroy()
+
+
+def test_exhausted_retries_go_to_backlog(make_config):
+    writer = failing_writer(make_config, failures=10, max_attempts=2)
+    writer.write_batch(take_batch(writer, 5))
+    while True:
+        retry = writer.next_retry()
+        if retry is None:
+            break
+        writer.write_batch(retry[2], retry[1])
+    assert writer.attempts == 3
+    assert not writer._is_healthy
+    assert writer.backlog.size() == 5 and writer.written == []
+    writer.destroy()
+
+
+def test_retries_are_bounded_by_max_items(make_config):
+    writer = failing_writer(make_config, failures=10, max_attempts=3, max_items=8)
+    writer.write_batch(take_batch(writer, 5))
+    writer.write_batch(take_batch(writer, 5))
+    assert len(writer.retries) == 1 and writer.retry_items == 5
+    assert writer.backlog.size() == 5 and not writer._is_healthy
+    writer.destroy()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import pytest
+
+from yamc.providers import XmlHttpProvider
+
+STATUS = b"""<?xml version="1.0"?>
+<?xml-stylesheet type="text/xsl" href="status.xsl"?>
+<!-- the status of the host -->
+<status>
+  <cpu id="0"><load>0.5</load></cpu>
+  <disks>
+    <disk name="sda"><free>10</free></disk>
+    <disk name="sdb"><free>20</free></disk>
+  </disks>
+</status>
+"""
+
+
+def create_provider(make_config, data=STATUS, **properties):
+    config = make_config(
+        providers={"status": dict(url="http://localhost/status.xml", **properties)}
+    )
+    provider = XmlHttpProvider(config, "status")
+    provider.fetch = lambda: (data, None, None)
+    return provider
+
+
+@pytest.mark.parametrize("mode", ["tree", "stream"])
+def test_nodes_before_root(make_config, mode):
+    provider = create_provider(
+        make_config,
+        mode=mode,
+        elements={"load": "/status/cpu/load", "cpu": "/status/cpu/@id"},
+        records={"disks": "/status/disks/disk"},
+        types={"/status/disks/disk/free": "int"},
+    )
+    if mode == "tree":
+        assert provider.xpath("/status/cpu/load/text()") == 0.5
+        assert provider.xpath("count(/status/disks/disk)") == 2
+    else:
+        assert provider.value("load") == 0.5
+        assert provider.value("cpu") == 0
+        assert provider.records("disks") == [
+            {"name": "sda", "free": 10},
+            {"name": "sdb", "free": 20},
+        ]
+
+
+def test_stream_missing_element(make_config):
+    provider = create_provider(
+        make_config, mode="stream", elements={"mem": "/status/mem"}
+    )
+    with pytest.raises(Exception, match="was not found"):
+        provider.value("mem")
+
+
+def test_stream_clears_processed_elements(make_config):
+    data = b"<status>%s</status>" % b"".join(
+        [b"<disk><free>%d</free></disk>" % i for i in range(1000)]
+    )
+    provider = create_provider(
+        make_config,
+        data=data,
+        mode="stream",
+        records={"disks": "/status/disk"},
+        types={"/status/disk/free": "int"},
+    )
+    assert [r.free for r in provider.records("disks")] == list(range(1000))
@@ -13,12 +13,34 @@ import yamc.providers
 
 # from .config import ColoredFormatter
 
-from .utils import Map, import_class
+from .utils import Map, import_class, merge_dicts
 
 __version__ = "1.1.0"
 
 yamc_scope = Map(writers=None, collectors=None, providers=None, all_components=[])
 
+# the cached global layer of the evaluation scope
+_global_scope = None
+
+
+def global_scope(custom_functions=None):
+    """
+    Returns the global layer of the evaluation scope with components and custom functions.
+    The layer is cached until `invalidate_scope` is called.
+    """
+    global _global_scope
+    if _global_scope is None or _global_scope[0] is not custom_functions:
+        _global_scope = (custom_functions, merge_dicts(yamc_scope, custom_functions))
+    return _global_scope[1]
+
+
+def invalidate_scope():
+    """
+    Invalidates the cached global layer of the evaluation scope when components change.
+    """
+    global _global_scope
+    _global_scope = None
+
 
 def load_components(name, config):
     components = Map()
@@ -38,7 +60,9 @@ def load_components(name, config):
 def init_scope(config):
     global yamc_scope
     yamc_scope.writers = load_components("writers", config)
+    invalidate_scope()
     yamc_scope.providers = load_components("providers", config)
+    invalidate_scope()
     yamc_scope.collectors = load_components("collectors", config)
     yamc_scope.all_components = (
         list(yamc_scope.writers.values())
@@ -48,6 +72,7 @@ def init_scope(config):
     if config.custom_functions is not None:
         for k, v in config.custom_functions.items():
             yamc_scope[k] = v
+    invalidate_scope()
 
 
 def start_components(exit_event):
@@ -9,10 +9,19 @@ import threading
 import croniter
 import sys
 import copy
+import random
+import zlib
 
 from datetime import datetime
 from yamc import WorkerComponent
-from yamc.utils import Map, deep_eval, merge_dicts
+from yamc.utils import (
+    Map,
+    Record,
+    RingBuffer,
+    EvalPlan,
+    merge_dicts,
+)
+from .scheduler import get_scheduler, OVERRUN_POLICIES
 
 
 class BaseCollector(WorkerComponent):
@@ -35,6 +44,10 @@ class BaseCollector(WorkerComponent):
             self.writers[w["writer_id"]] = {
                 k: v for k, v in w.items() if k != "writer_id"
             }
+            # the writer config is compiled to a single evaluation plan
+            self.writers[w["writer_id"]]["__plan"] = EvalPlan(
+                self.writers[w["writer_id"]]
+            )
             self.writers[w["writer_id"]]["__writer"] = None
 
         for w in yamc_scope.writers.values():
@@ -53,8 +66,24 @@ class BaseCollector(WorkerComponent):
             raise Exception(
                 "The value of data property must be dict or a Python expression!"
             )
+        self.data_plan = None
+        if isinstance(self.data_def, dict):
+            self.data_plan = EvalPlan(self.data_def)
         self.max_history = self.config.value_int("max_history", default=120)
-        self.history = []
+
+        # the history is referenced by expressions of any collector as `collectors.<id>.history`
+        self._history = (
+            RingBuffer(max_count=self.max_history) if self.max_history > 0 else None
+        )
+
+    @property
+    def history(self):
+        """
+        The `RingBuffer` with the last `max_history` data items of this collector. Use
+        `history.last(n)` and `history.since(t)` to get windows of items without copying them;
+        the timestamps are the times when the data items were collected.
+        """
+        return self._history if self._history is not None else []
 
     def add_time(self, data):
         if data.get("time") is None:
@@ -63,12 +92,11 @@ class BaseCollector(WorkerComponent):
 
     def prepare_data(self, scope=None):
         _data, data = [], None
-        if isinstance(self.data_def, dict):
-            data = deep_eval(
-                Map(self.data_def),
-                scope=self.base_scope(custom_scope=scope),
-                log=self.log,
-                raise_ex=False,
+        if self.data_plan is not None:
+            data = Record(
+                self.data_plan.eval(
+                    self.base_scope(custom_scope=scope), log=self.log, raise_ex=False
+                )
             )
         elif callable(getattr(self.data_def, "eval", None)):
             data = self.data_def.eval(self.base_scope(custom_scope=scope))
@@ -82,30 +110,41 @@ class BaseCollector(WorkerComponent):
             _data.append(self.add_time(data))
         else:
             raise Exception("The data must be dict or list!")
-        if self.max_history > 0:
-            self.history += _data
-            self.history = self.history[-min(self.max_history, len(self.history)) :]
+        if self._history is not None:
+            t = time.time()
+            for d in _data:
+                self._history.append(d, t)
         return _data
 
     def write(self, data, scope=None):
-        _scope = Map() if scope is None else scope
+        _scope = Record() if scope is None else scope
         _scope.data = data
         for w in self.writers.values():
             if w["__writer"] is not None:
-                writer_config = Map({k: v for k, v in w.items() if k != "__writer"})
                 w["__writer"].write(
                     self.component_id,
                     data,
-                    deep_eval(
-                        writer_config,
-                        self.base_scope(_scope),
-                        log=self.log,
-                        raise_ex=False,
+                    Record(
+                        w["__plan"].eval(
+                            self.base_scope(_scope), log=self.log, raise_ex=False
+                        )
                     ),
                 )
 
 
 class CronCollector(BaseCollector):
+    """
+    Collector that runs on a cron schedule. Runs of all cron collectors are dispatched by the
+    shared `Scheduler`. The runs can be shifted by a stable offset within `spread` seconds that
+    is derived from the collector's id and by a random `jitter` to flatten load spikes when many
+    collectors have the same schedule.
+
+    A run that exceeds `timeout` seconds is abandoned and its data is not written. The `overrun`
+    policy determines what happens when a run is due while the previous run is still running:
+    `skip` the run, `coalesce` missed runs into a single run after the previous run ends or run
+    `concurrent` runs up to `max_concurrent`. The durations and lags of runs are in `stats`.
+    """
+
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
         self.schedule = self.config.value_str("schedule", required=True)
@@ -113,38 +152,91 @@ class CronCollector(BaseCollector):
             raise Exception(
                 "The value of schedule property '%s' is not valid!" % self.schedule
             )
+        self.spread = self.config.value("spread", default=0, required=False)
+        self.jitter = self.config.value("jitter", default=0, required=False)
+        self.offset = (
+            zlib.crc32(component_id.encode("utf-8")) % 1000 / 1000 * self.spread
+        )
+        self.timeout = self.config.value("timeout", default=None)
+        self.overrun = self.config.value_str("overrun", default="skip")
+        if self.overrun not in OVERRUN_POLICIES:
+            raise Exception(
+                "Invalid overrun policy '%s', the policy must be one of %s!"
+                % (self.overrun, ", ".join(OVERRUN_POLICIES))
+            )
+        self.max_concurrent = self.config.value_int("max_concurrent", default=2, min=1)
+        self.stats = Map(
+            runs=0,
+            failures=0,
+            skipped=0,
+            coalesced=0,
+            timeouts=0,
+            last_duration=None,
+            max_duration=0,
+            last_lag=None,
+            max_lag=0,
+        )
+        self.itr = None
         self.log.info("The cron schedule is %s" % (self.schedule))
 
-    def get_time_to_sleep(self, itr):
+    def next_run(self, now):
+        """
+        Returns the time of the next run after `now`.
+        """
+        if self.itr is None:
+            self.itr = croniter.croniter(self.schedule, datetime.fromtimestamp(now))
         while True:
-            next_run = itr.get_next(datetime)
-            seconds = (next_run - datetime.now()).total_seconds()
-            if seconds > 0:
+            next_run = (
+                self.itr.get_next(datetime).timestamp()
+                + self.offset
+                + random.uniform(0, self.jitter)
+            )
+            if next_run > now:
                 break
-            else:
-                self.log.warning(
-                    f"The next run of the job {self.component_id} already passed by {seconds} seconds. Trying the next iteration."
-                )
+            self.log.warning(
+                f"The next run of the job {self.component_id} already passed by {now - next_run} seconds. Trying the next iteration."
+            )
         self.log.debug(
-            f"The next job of '{self.component_id}' will run at {next_run} (in {seconds} seconds)."
+            f"The next job of '{self.component_id}' will run at {datetime.fromtimestamp(next_run)} (in {next_run - now} seconds)."
         )
-        return seconds
+        return next_run
 
-    def worker(self, exit_event):
-        itr = croniter.croniter(self.schedule, datetime.now())
-        time2sleep = self.get_time_to_sleep(itr)
-        while not exit_event.is_set():
-            exit_event.wait(time2sleep)
-            if not exit_event.is_set():
-                self.log.info("Running job '%s'." % self.component_id)
-                try:
-                    self.write(self.prepare_data())
-                except Exception as e:
-                    self.log.error(
-                        "The job failed due to %s" % (str(e)),
-                        exc_info=self.args.debug or self.args.trace,
-                    )
-                time2sleep = self.get_time_to_sleep(itr)
+    def run(self, run=None):
+        self.log.info("Running job '%s'." % self.component_id)
+        try:
+            data = self.prepare_data()
+            if run is not None and run.timed_out:
+                self.log.warning(
+                    "The job exceeded the timeout of %s seconds, its data will be discarded."
+                    % self.timeout
+                )
+                return
+            self.write(data)
+        except Exception as e:
+            self.stats.failures += 1
+            self.log.error(
+                "The job failed due to %s" % (str(e)),
+                exc_info=self.args.debug or self.args.trace,
+            )
+        finally:
+            if run is not None:
+                self.log.debug(
+                    "The job finished in %.3f seconds with the lag of %.3f seconds."
+                    % (time.time() - run.started, run.started - run.scheduled)
+                )
+
+    def start(self, exit_event):
+        self.start_time = time.time()
+        scheduler = get_scheduler(self.base_config)
+        scheduler.add(self)
+        scheduler.start(exit_event)
+
+    def running(self):
+        scheduler = get_scheduler(self.base_config)
+        return scheduler.thread is not None and scheduler.thread.is_alive()
+
+    def join(self):
+        get_scheduler(self.base_config).join()
 
 
 class EventCollector(BaseCollector):
@@ -160,7 +252,7 @@ class EventCollector(BaseCollector):
             self.log.info(f"Subscribing to events from '{s.id}'")
             s.subscribe(
                 lambda x: self.write(
-                    self.prepare_data(scope=Map(event=x)), scope=Map(event=x)
+                    self.prepare_data(scope=Record(event=x)), scope=Record(event=x)
                 )
             )
         while not exit_event.is_set():
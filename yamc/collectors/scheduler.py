@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import time
+import heapq
+import logging
+import queue
+import threading
+
+# the scheduler shared by all cron collectors
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# policies for runs that are due while the previous runs are still running
+OVERRUN_POLICIES = ["skip", "coalesce", "concurrent"]
+
+
+class Run:
+    """
+    A single run of a job. The run is timed out when it runs longer than the job's timeout.
+    """
+
+    def __init__(self, job, scheduled):
+        self.job = job
+        self.scheduled = scheduled
+        self.started = None
+        self.thread = None
+        self.timed_out = False
+
+
+class WorkerPool:
+    """
+    Pool of `size` daemon threads that run the submitted tasks. A thread whose task was abandoned
+    is not counted in the pool and is replaced by a new thread so that a task that never ends
+    does not reduce the capacity of the pool; the abandoned thread exits when its task ends.
+    """
+
+    def __init__(self, size, name="scheduler"):
+        self.size = size
+        self.name = name
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        # the number of threads that were not abandoned
+        self.threads = 0
+        self.abandoned = set()
+        self.seq = 0
+
+    def spawn(self):
+        self.threads += 1
+        self.seq += 1
+        threading.Thread(
+            target=self.worker, name="%s_%d" % (self.name, self.seq), daemon=True
+        ).start()
+
+    def start(self):
+        with self.lock:
+            while self.threads < self.size:
+                self.spawn()
+
+    def submit(self, fn, *args):
+        self.tasks.put((fn, args))
+
+    def abandon(self, thread):
+        """
+        Replaces the `thread` that runs an abandoned task.
+        """
+        with self.lock:
+            if thread is not None and thread not in self.abandoned:
+                self.abandoned.add(thread)
+                self.threads -= 1
+                self.spawn()
+
+    def worker(self):
+        thread = threading.current_thread()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            fn, args = task
+            fn(*args)
+            with self.lock:
+                if thread in self.abandoned:
+                    self.abandoned.remove(thread)
+                    return
+        with self.lock:
+            self.threads -= 1
+
+    def shutdown(self):
+        with self.lock:
+            for _ in range(self.threads):
+                self.tasks.put(None)
+
+
+class Scheduler:
+    """
+    Scheduler of jobs in a heap ordered by the jobs' next run times. A single thread dispatches
+    the due jobs to a pool of `pool_size` threads so that the number of threads does not grow
+    with the number of jobs.
+
+    A job must provide `next_run(now)` that returns the time of its next run, `run(run)` and the
+    properties `timeout`, `overrun`, `max_concurrent` and `stats`. When a job is due while its
+    previous runs are running, the `overrun` policy determines whether the run is skipped, runs
+    once after the previous run ends (coalesce) or runs concurrently up to `max_concurrent` runs.
+    A run that exceeds the `timeout` is abandoned; the thread cannot be stopped, the job should
+    discard the results of the timed-out run. The abandoned run counts towards the job's runs until
+    it ends so that a job that hangs is not dispatched again, and its thread is replaced in the pool
+    so that other jobs are not starved.
+    """
+
+    def __init__(self, pool_size=8, log=None):
+        self.pool_size = pool_size
+        self.log = log if log is not None else logging.getLogger("scheduler")
+        self.heap = []
+        self.seq = 0
+        self.cond = threading.Condition()
+        # runs of jobs that are running
+        self.runs = {}
+        # runs of jobs that timed out and did not end yet
+        self.abandoned = {}
+        # jobs with a coalesced run
+        self.pending = set()
+        self.pool = None
+        self.thread = None
+
+    def add(self, job):
+        with self.cond:
+            self.seq += 1
+            heapq.heappush(self.heap, (job.next_run(time.time()), self.seq, job))
+            self.cond.notify()
+
+    def start(self, exit_event):
+        with self.cond:
+            if self.thread is None:
+                self.pool = WorkerPool(self.pool_size)
+                self.pool.start()
+                self.thread = threading.Thread(
+                    target=self.worker, args=(exit_event,), daemon=True
+                )
+                self.thread.start()
+
+    def max_runs(self, job):
+        return job.max_concurrent if job.overrun == "concurrent" else 1
+
+    def active_runs(self, job):
+        """
+        Returns the number of runs of the job including the abandoned runs that did not end.
+        """
+        return len(self.runs.get(job, [])) + len(self.abandoned.get(job, []))
+
+    def dispatch(self, job, scheduled):
+        if self.active_runs(job) < self.max_runs(job):
+            self.submit(job, scheduled)
+        elif job.overrun == "coalesce" and job not in self.pending:
+            job.stats.coalesced += 1
+            self.pending.add(job)
+        else:
+            job.stats.skipped += 1
+            self.log.warning(
+                "The job '%s' is still running, the run is skipped." % job.component_id
+            )
+
+    def submit(self, job, scheduled):
+        run = Run(job, scheduled)
+        self.runs.setdefault(job, []).append(run)
+        self.pool.submit(self.run, run)
+
+    def release(self, run):
+        """
+        Removes the run from the running runs and submits the coalesced run of the job.
+        """
+        job = run.job
+        if run.timed_out:
+            self.abandoned[job].remove(run)
+        else:
+            self.runs[job].remove(run)
+        if job in self.pending and self.active_runs(job) < self.max_runs(job):
+            self.pending.discard(job)
+            self.submit(job, time.time())
+
+    def run(self, run):
+        run.thread = threading.current_thread()
+        run.started = time.time()
+        try:
+            run.job.run(run)
+        except Exception as e:
+            self.log.error("The job '%s' failed: %s" % (run.job.component_id, str(e)))
+        finally:
+            duration = time.time() - run.started
+            with self.cond:
+                stats = run.job.stats
+                stats.runs += 1
+                stats.last_duration = duration
+                stats.max_duration = max(stats.max_duration, duration)
+                stats.last_lag = run.started - run.scheduled
+                stats.max_lag = max(stats.max_lag, stats.last_lag)
+                self.release(run)
+                self.cond.notify()
+
+    def check_timeouts(self, now):
+        """
+        Abandons the runs that exceeded their job's timeout. Returns the time of the nearest timeout.
+        """
+        nearest = None
+        for job, runs in self.runs.items():
+            if job.timeout is None:
+                continue
+            for run in list(runs):
+                if run.started is None:
+                    continue
+                deadline = run.started + job.timeout
+                if deadline <= now:
+                    run.timed_out = True
+                    job.stats.timeouts += 1
+                    self.log.error(
+                        "The job '%s' exceeded the timeout of %s seconds, the run is abandoned."
+                        % (job.component_id, job.timeout)
+                    )
+                    runs.remove(run)
+                    self.abandoned.setdefault(job, []).append(run)
+                    self.pool.abandon(run.thread)
+                elif nearest is None or deadline < nearest:
+                    nearest = deadline
+        return nearest
+
+    def worker(self, exit_event):
+        self.log.info("Starting the scheduler with %d threads." % self.pool_size)
+        while not exit_event.is_set():
+            with self.cond:
+                now = time.time()
+                while len(self.heap) > 0 and self.heap[0][0] <= now:
+                    t, seq, job = heapq.heappop(self.heap)
+                    self.dispatch(job, t)
+                    self.seq += 1
+                    heapq.heappush(self.heap, (job.next_run(now), self.seq, job))
+                timeout = self.heap[0][0] - now if len(self.heap) > 0 else 1
+                nearest = self.check_timeouts(now)
+                if nearest is not None:
+                    timeout = min(timeout, nearest - now)
+                # wait in short intervals to check the exit event
+                self.cond.wait(max(0, min(timeout, 1)))
+        # wait for the running runs, the runs that time out are abandoned
+        with self.cond:
+            self.pending.clear()
+            while any([len(runs) > 0 for runs in self.runs.values()]):
+                nearest = self.check_timeouts(time.time())
+                self.cond.wait(
+                    1 if nearest is None else max(0, min(nearest - time.time(), 1))
+                )
+        self.pool.shutdown()
+        self.log.info("The scheduler ended.")
+
+    def join(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join()
+
+
+def get_scheduler(config):
+    """
+    Returns the scheduler shared by all cron collectors, the size of its pool is
+    the `scheduler.pool_size` configuration property.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler(
+                pool_size=config.config.value_int(
+                    "scheduler.pool_size", default=8, min=1
+                )
+            )
+        return _scheduler
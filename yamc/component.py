@@ -8,7 +8,7 @@ import logging
 import threading
 import time
 
-from .utils import merge_dicts
+from .utils import Scope
 
 
 class BaseComponent:
@@ -20,9 +20,12 @@ class BaseComponent:
         self.enabled = True
 
     def base_scope(self, custom_scope=None):
-        from yamc import yamc_scope
+        """
+        Returns the evaluation scope with the `custom_scope` layer on top of the global layer.
+        """
+        from yamc import global_scope
 
-        return merge_dicts(yamc_scope, self.base_config.custom_functions, custom_scope)
+        return Scope(custom_scope, global_scope(self.base_config.custom_functions))
 
     def destroy(self):
         pass
@@ -18,7 +18,7 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 import imp
 
 from .utils import PythonExpression
-from .utils import deep_find, import_class, Map, deep_merge, merge_dicts
+from .utils import deep_find, import_class, Map, deep_merge, Scope
 from functools import reduce
 from yamc import yamc_scope
 
@@ -381,10 +381,17 @@ class ConfigPart:
                 if not no_eval:
                     if callable(getattr(val, "eval", None)):
                         try:
-                            from yamc import yamc_scope
+                            from yamc import global_scope
 
                             val = val.eval(
-                                merge_dicts(self.parent.custom_functions, yamc_scope)
+                                Scope(
+                                    None,
+                                    global_scope(
+                                        self.parent.custom_functions
+                                        if self.parent is not None
+                                        else None
+                                    ),
+                                )
                             )
                         except Exception as e:
                             raise Exception(
@@ -5,6 +5,11 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 import requests
+import io
+import csv
+import hashlib
+import itertools
+import functools
 import time
 import re
 import threading
@@ -15,7 +20,37 @@ from yamc import BaseComponent
 
 from enum import Enum
 
-from yamc.utils import Map
+from yamc.utils import Map, Record, RingBuffer, backoff_delay
+from urllib.parse import urlparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# HTTP adapters with connection pools shared by providers of the same host
+_adapters = {}
+_adapters_lock = threading.Lock()
+
+
+def create_session(url, pool_size=10):
+    """
+    Creates a session for the url. The session has its own cookies and authentication while
+    its connection pool is shared by all sessions of the url's scheme and host so that the
+    connections to the host are reused. The size of the pool is set by the first session of
+    the host.
+    """
+    u = urlparse(url)
+    prefix = "%s://%s" % (u.scheme, u.netloc)
+    with _adapters_lock:
+        adapter = _adapters.get(prefix)
+        if adapter is None:
+            adapter = _adapters[prefix] = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+    session = requests.session()
+    session.mount(prefix, adapter)
+    return session
 
 
 class BaseProvider(BaseComponent):
@@ -65,16 +100,48 @@ class BaseProvider(BaseComponent):
 class HttpProvider(BaseProvider):
     """
     A generic HTTP provider that retrieves data using HTTP.
+
+    Providers of the same host share the connection pool, each provider has its own session. The requests are
+    conditional with the ETag and Last-Modified validators of the last response, and a response
+    with the same content as the last one is not parsed again; `changed_time` is the time when
+    the content last changed.
+
+    The data is retrieved when it is older than `max_age` seconds by a single caller while other
+    callers wait for the retrieval. When `max_stale` is set, callers get the cached data up to
+    `max_stale` seconds after it expired while it is retrieved in the background. When the retrieval fails, the next attempt is made after a backoff delay; callers
+    do not wait for it and get the cached data or the error. When `refresh_ahead` is set, the data
+    is retrieved in the background `refresh_ahead` seconds before it expires.
     """
 
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
         self.url = self.config.value_str("url")
         self.max_age = self.config.value("max_age", default=10)
+        self.max_stale = self.config.value("max_stale", default=0, required=False)
+        self.refresh_ahead = self.config.value("refresh_ahead", default=None)
+        self.retry_delay = self.config.value("retry_delay", default=1)
+        self.retry_max_delay = self.config.value("retry_max_delay", default=60)
         self.init_url = self.config.value("init_url", default=None)
         self.init_max_age = self.config.value("init_max_age", default=None)
-        self.lock = threading.Lock()
-        self.session = requests.session()
+        self.timeout = (
+            self.config.value("connect_timeout", default=5),
+            self.config.value("read_timeout", default=30),
+        )
+        self.conditional = self.config.value_bool("conditional", default=True)
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self._changed_time = None
+        self.lock = threading.Condition()
+        self.fetching = False
+        self.failures = 0
+        self.retry_time = 0
+        self.last_error = None
+        self.refresher = None
+        self.exit_event = threading.Event()
+        self.session = create_session(
+            self.url, self.config.value_int("pool_size", default=10, min=1)
+        )
         self.init_time = None
         self.init_session()
 
@@ -82,115 +149,490 @@ class HttpProvider(BaseProvider):
         try:
             if self.init_url is not None and (
                 self.init_time is None
-                or time.time() - self.init_time > self.init_max_age
+                or (
+                    self.init_max_age is not None
+                    and time.time() - self.init_time > self.init_max_age
+                )
             ):
                 self.init_time = time.time()
                 self.log.info(
                     "Running the initialization request at %s" % (self.init_url)
                 )
-                self.session.get(self.init_url)
+                self.session.get(self.init_url, timeout=self.timeout)
         except Exception as e:
             self.log.error("The initialization request failed due to %s" % (str(e)))
 
-    def update(self):
+    def destroy(self):
+        super().destroy()
+        self.exit_event.set()
+
+    @property
+    def changed_time(self):
+        self.update()
+        return self._changed_time
+
+    def fetch(self):
+        """
+        Retrieves the data from the url. Returns the content and the response validators,
+        the content is None when the resource was not modified.
+        """
+        self.init_session()
+        headers = {}
+        if self.conditional and self.data is not None:
+            if self.etag is not None:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified is not None:
+                headers["If-Modified-Since"] = self.last_modified
+        r = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        if r.status_code == 304:
+            return None, self.etag, self.last_modified
+        if r.status_code == 404:
+            raise Exception("The resource at %s does not exist!" % (self.url))
+        elif r.status_code >= 400:
+            raise Exception(
+                "The request at %s failed, status-code=%d" % (self.url, r.status_code)
+            )
+        return r.content, r.headers.get("ETag"), r.headers.get("Last-Modified")
+
+    def parse(self, data):
+        """
+        Processes the retrieved data before it is available to other callers.
+        """
+        pass
+
+    def is_stale_ok(self, now):
+        return (
+            self.data is not None
+            and now - self._updated_time <= self.max_age + self.max_stale
+        )
+
+    def update(self, refresh=False):
+        """
+        Retrieves the data when it expired. The expired data that is not older than `max_stale`
+        is returned and retrieved in the background. The `refresh` flag retrieves the data
+        `refresh_ahead` seconds before it expires. Returns True when the data changed in this
+        call.
+        """
+        if self.refresh_ahead is not None and self.refresher is None:
+            self.start_refresher()
         with self.lock:
-            if (
-                self._updated_time is None
-                or self.data is None
-                or time.time() - self._updated_time > self.max_age
-            ):
-                self.init_session()
-                num_retries = 0
-                while num_retries < 3:
-                    self._updated_time = time.time()
-                    r = self.session.get(self.url)
-                    if r.status_code == 404:
-                        raise Exception(
-                            "The resource at %s does not exist!" % (self.url)
+            while True:
+                now = time.time()
+                expires = (
+                    self._updated_time + self.max_age if self.data is not None else now
+                )
+                if refresh and self.refresh_ahead is not None:
+                    expires -= self.refresh_ahead
+                if now < expires:
+                    self.log.debug(
+                        "The url '%s' retrieved data from cache." % (self.url)
+                    )
+                    return False
+                if self.fetching or now < self.retry_time:
+                    if self.is_stale_ok(now):
+                        self.log.debug(
+                            "The url '%s' retrieved stale data from cache." % (self.url)
                         )
-                    elif r.status_code >= 400:
-                        self.log.error(
-                            "The request at %s failed, status-code=%d, num-retries=%d"
-                            % (self.url, r.status_code, num_retries)
+                        return False
+                    if not self.fetching:
+                        raise Exception(
+                            "The resource at %s is not available, the next attempt is in %.1f seconds. %s"
+                            % (self.url, self.retry_time - now, str(self.last_error))
                         )
-                        num_retries += 1
-                        if num_retries == 3:
-                            raise Exception(
-                                "Cannot retrieve the resource at %s after %d attempts!"
-                                % (self.url, num_retries)
-                            )
-                        time.sleep(1)
-                    else:
-                        break
-                # self.log.debug("The url '%s' retrieved the following data: %s"%(self.url,str(r.content.decode(self.encoding))))
-                self.log.debug(
-                    "The url '%s' retrieved the following data: (strip)" % (self.url)
-                )
-                self.data = r.content
-                return True
-            else:
-                self.log.debug("The url '%s' retrieved data from cache." % (self.url))
+                    # wait for the data retrieved by other caller
+                    self.lock.wait()
+                    continue
+                self.fetching = True
+                if not refresh and self.is_stale_ok(now):
+                    # revalidate in the background and return the stale data
+                    threading.Thread(
+                        target=self.revalidate_background, daemon=True
+                    ).start()
+                    return False
+                break
+        return self.revalidate()
+
+    def revalidate(self):
+        """
+        Retrieves and parses the data, the caller must set the `fetching` flag. Returns True
+        when the data changed.
+        """
+        try:
+            data, etag, last_modified = self.fetch()
+            content_hash = None
+            if data is not None:
+                content_hash = hashlib.sha1(data).digest()
+                if content_hash == self.content_hash:
+                    data = None
+            if data is not None:
+                self.parse(data)
+        except Exception as e:
+            self.failed(e)
+            if self.is_stale_ok(time.time()):
                 return False
+            raise
+
+        with self.lock:
+            self._updated_time = time.time()
+            if data is not None:
+                self.log.debug("The url '%s' retrieved new data." % (self.url))
+                self.data = data
+                self.content_hash = content_hash
+                self._changed_time = self._updated_time
+            else:
+                self.log.debug("The url '%s' data did not change." % (self.url))
+            self.etag, self.last_modified = etag, last_modified
+            self.fetching = False
+            self.failures = 0
+            self.retry_time = 0
+            self.lock.notify_all()
+        return data is not None
+
+    def revalidate_background(self):
+        """
+        Revalidates the data in a background thread.
+        """
+        try:
+            self.revalidate()
+        except Exception as e:
+            self.failed(e)
+
+    def failed(self, e):
+        """
+        Logs the failed retrieval and schedules the next attempt after a backoff delay.
+        """
+        with self.lock:
+            if not self.fetching:
+                # the failure was already handled
+                return
+            self.fetching = False
+            self.last_error = e
+            self.retry_time = time.time() + backoff_delay(
+                self.failures, self.retry_delay, self.retry_max_delay
+            )
+            self.failures += 1
+            self.log.error(
+                "The request at %s failed, num-failures=%d, the next attempt is in %.1f seconds: %s"
+                % (self.url, self.failures, self.retry_time - time.time(), str(e))
+            )
+            self.lock.notify_all()
+
+    def start_refresher(self):
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self.refresh, daemon=True)
+                self.refresher.start()
+
+    def refresh(self):
+        """
+        Retrieves the data in the background before it expires.
+        """
+        while not self.exit_event.is_set():
+            try:
+                self.update(refresh=True)
+            except Exception:
+                pass
+            now = time.time()
+            if self.data is not None:
+                next_time = self._updated_time + self.max_age - self.refresh_ahead
+            else:
+                next_time = now
+            self.exit_event.wait(max(next_time, self.retry_time, now + 0.1) - now)
+
+
+def to_bool(v):
+    if isinstance(v, str):
+        return v.strip().lower() in ("true", "1", "yes", "on")
+    return bool(v)
+
+
+# converters of values to the declared types
+VALUE_TYPES = {"int": int, "float": float, "str": str, "bool": to_bool}
+
+
+def local_name(tag):
+    return tag[tag.rfind("}") + 1 :]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_xpath(xpath, namespaces=None):
+    """
+    Returns the compiled xpath expression, `namespaces` is a tuple of prefix and uri pairs.
+    """
+    return etree.XPath(xpath, namespaces=dict(namespaces) if namespaces else None)
 
 
 class XmlHttpProvider(HttpProvider):
     """
-    XML data provider retrieved over HTTP.
+    XML data provider retrieved over HTTP. The xpath expressions are compiled once and cached.
+    Values are converted to the types declared in the `types` property that maps expressions
+    to `int`, `float`, `str` or `bool`, or to the type passed to `xpath`; values without the
+    type are converted to int, float or str, whichever succeeds first.
+
+    In the `stream` mode, the document is parsed incrementally and the tree is not kept in
+    memory. Only the values of `elements`, which maps names to absolute element paths such as
+    `/status/cpu/load` or `/status/cpu/@id`, are available by `value(name)`. The elements with
+    the paths in `records` are available by `records(name)` as lists of records with the
+    element's attributes and the texts of its child elements; the texts are converted to the
+    types declared for `<record path>/<child name>`. The paths use local names of the elements.
     """
 
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
         self.encoding = self.config.value_str("encoding", default="utf-8")
         self.namespaces = self.config.value("namespaces", default=None)
+        self.namespaces_key = (
+            tuple(sorted(self.namespaces.items())) if self.namespaces else None
+        )
         self.str_decode_unicode = self.config.value("str_decode_unicode", default=True)
+        self.types = {
+            k: self.value_type(v)
+            for k, v in self.config.value("types", default={}, required=False).items()
+        }
+        self.mode = self.config.value_str("mode", default="tree")
+        if self.mode not in ("tree", "stream"):
+            raise Exception(
+                "Invalid mode '%s', the mode must be tree or stream!" % self.mode
+            )
+        self.elements = {}
+        for name, path in self.config.value(
+            "elements", default={}, required=False
+        ).items():
+            path, _, attr = path.partition("/@")
+            self.elements.setdefault(path, []).append((name, attr or None))
+        self.record_paths = {
+            path: name
+            for name, path in self.config.value(
+                "records", default={}, required=False
+            ).items()
+        }
         self.xmlroot = None
+        self.values = {}
+        self.record_lists = {}
 
-    def update(self):
-        if super().update() or self.xmlroot is None:
-            self.xmlroot = etree.fromstring(self.data)
-            return True
-        else:
-            return False
+    def value_type(self, type):
+        if type is None or callable(type):
+            return type
+        if type not in VALUE_TYPES:
+            raise Exception(
+                "Invalid type '%s', the type must be one of %s!"
+                % (type, ", ".join(VALUE_TYPES.keys()))
+            )
+        return VALUE_TYPES[type]
 
-    def xpath(self, xpath, diff=False):
-        def _value(v):
-            return v if not diff else self.diff(xpath, v)
+    def parse(self, data):
+        if self.mode == "stream":
+            self.parse_stream(data)
+        else:
+            self.xmlroot = etree.fromstring(data)
+
+    def element_record(self, path, elem):
+        record = Record(elem.attrib)
+        for child in elem:
+            if len(child) == 0:
+                name = local_name(child.tag)
+                type = self.types.get(path + "/" + name)
+                record[name] = (
+                    child.text
+                    if type is None
+                    else self.convert(path + "/" + name, child.text or "", type)
+                )
+        return record
 
-        def _int_or_float_or_str(v):
-            if isinstance(v, str):
-                try:
-                    return _value(int(v.strip()))
-                except:
-                    try:
-                        return _value(float(v.strip()))
-                    except:
-                        return unidecode.unidecode(v) if self.str_decode_unicode else v
-            elif isinstance(v, int) or isinstance(v, float):
-                return _value(v)
-            else:
+    def parse_stream(self, data):
+        """
+        Extracts the values of `elements` and `records` from the document in a single pass.
+        The elements are cleared when they are processed, except for the elements of a record
+        that are cleared when the record ends.
+        """
+        values, record_lists = {}, {name: [] for name in self.record_paths.values()}
+        paths = []
+        in_record = 0
+        for event, elem in etree.iterparse(
+            io.BytesIO(data), events=("start", "end"), remove_comments=True
+        ):
+            if event == "start":
+                path = (paths[-1] if paths else "") + "/" + local_name(elem.tag)
+                paths.append(path)
+                if path in self.record_paths:
+                    in_record += 1
+                continue
+            path = paths.pop()
+            for name, attr in self.elements.get(path, ()):
+                if name not in values:
+                    values[name] = elem.text if attr is None else elem.get(attr)
+            if path in self.record_paths:
+                record_lists[self.record_paths[path]].append(
+                    self.element_record(path, elem)
+                )
+                in_record -= 1
+            if in_record == 0:
+                elem.clear()
+                # the root element has no parent but can have siblings such as comments
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+        self.values, self.record_lists = values, record_lists
+
+    def value(self, name, diff=False, type=None):
+        """
+        Returns the value of the element with `name` extracted in the stream mode.
+        """
+        self.update()
+        values = self.values
+        if name not in values:
+            raise Exception("The element '%s' was not found!" % name)
+        if values[name] is None:
+            raise Exception("The element '%s' has no value!" % name)
+        v = self.convert(
+            name, values[name], self.value_type(type) if type else self.types.get(name)
+        )
+        if diff and (isinstance(v, int) or isinstance(v, float)):
+            return self.diff(name, v)
+        return v
+
+    def records(self, name):
+        """
+        Returns the list of records with `name` extracted in the stream mode.
+        """
+        self.update()
+        if name not in self.record_lists:
+            raise Exception("The records '%s' do not exist!" % name)
+        return self.record_lists[name]
+
+    def convert(self, xpath, v, type):
+        if type is not None:
+            if isinstance(v, etree._Element):
+                v = v.text
+            if type is str:
+                v = str(v)
+                return unidecode.unidecode(v) if self.str_decode_unicode else v
+            try:
+                return type(v.strip() if isinstance(v, str) else v)
+            except Exception as e:
                 raise Exception(
-                    "The xpath expression '%s' must provide a value of type int or float! The value was '%s'."
-                    % (xpath, str(v))
+                    "The value '%s' of the xpath expression '%s' cannot be converted to %s! %s"
+                    % (str(v), xpath, type.__name__, str(e))
                 )
+        if isinstance(v, str):
+            try:
+                return int(v.strip())
+            except:
+                try:
+                    return float(v.strip())
+                except:
+                    return unidecode.unidecode(v) if self.str_decode_unicode else v
+        elif isinstance(v, int) or isinstance(v, float):
+            return v
+        else:
+            raise Exception(
+                "The xpath expression '%s' must provide a value of type int or float! The value was '%s'."
+                % (xpath, str(v))
+            )
 
-        self.update()
-        d = self.xmlroot.xpath(xpath, namespaces=self.namespaces)
+    def evaluate(self, root, xpath, diff, type):
+        d = compile_xpath(xpath, self.namespaces_key)(root)
         if isinstance(d, list):
-            if len(d) > 0:
-                return _int_or_float_or_str(d[0])
-            else:
+            if len(d) == 0:
                 self.log.error(
                     "The xpath '%s' cannot be evaluated on the following data: %s"
-                    % (xpath, str(self.content.decode(self.encoding)))
+                    % (xpath, str(self.data.decode(self.encoding)))
                 )
                 raise Exception("The xpath '%s' cannot be evaluated!" % xpath)
-        else:
-            return _int_or_float_or_str(d)
+            d = d[0]
+        v = self.convert(
+            xpath, d, self.value_type(type) if type else self.types.get(xpath)
+        )
+        if diff and (isinstance(v, int) or isinstance(v, float)):
+            return self.diff(xpath, v)
+        return v
+
+    def xpath(self, xpath, diff=False, type=None):
+        """
+        Returns the value of the xpath expression converted to `type`.
+        """
+        self.update()
+        if self.xmlroot is None:
+            raise Exception("The xpath is not available in the stream mode!")
+        return self.evaluate(self.xmlroot, xpath, diff, type)
+
+    def xpaths(self, xpaths, diff=False):
+        """
+        Returns a `Record` with values of xpath expressions evaluated on the same document.
+        The `xpaths` dict maps names to xpath expressions or to (expression, type) pairs.
+        """
+        self.update()
+        root = self.xmlroot
+        if root is None:
+            raise Exception("The xpath is not available in the stream mode!")
+        result = Record()
+        for name, xpath in xpaths.items():
+            type = None
+            if isinstance(xpath, (tuple, list)):
+                xpath, type = xpath
+            result[name] = self.evaluate(root, xpath, diff, type)
+        return result
+
+
+def convert_column(values, type=None):
+    """
+    Converts the values to the type. When the type is None, the values are converted to int
+    or float, whichever succeeds for all values, and are left as str otherwise; int values
+    of a float column are kept as int. Returns the type and the converted values.
+    """
+    if type is str:
+        return str, list(values)
+    try:
+        converted = [(type or int)(v) for v in values]
+    except ValueError:
+        if type is not None:
+            raise
+        try:
+            floats = [float(v) for v in values]
+        except ValueError:
+            return str, list(values)
+        type = float
+        converted = [
+            int(v) if v.strip().lstrip("+-").isdigit() else f
+            for v, f in zip(values, floats)
+        ]
+    return type or int, column_array(converted, type or int)
+
+
+def column_array(values, type):
+    """
+    Returns the values as a NumPy array when NumPy is available. Values of int and float
+    columns are stored as int64 and float64; ints out of the int64 range and ints in a float
+    column are kept exact in an array of objects.
+    """
+    if np is None:
+        return values
+    if type is float and any(isinstance(v, int) for v in values):
+        return np.array(values, dtype=object)
+    try:
+        return np.array(values, dtype=np.int64 if type is int else np.float64)
+    except OverflowError:
+        return np.array(values, dtype=object)
+
+
+def to_number(v):
+    try:
+        return int(v.strip())
+    except:
+        try:
+            return float(v.strip())
+        except:
+            return v
 
 
 class CsvHttpProvider(HttpProvider):
     """
-    CSV data provider retrieved over HTTP.
+    CSV data provider retrieved over HTTP. The data is parsed to columns; the values of numeric
+    columns are converted to int or float in a single pass, to NumPy arrays when NumPy is
+    available, and the values of other columns are decoded to ASCII when they are accessed.
+    The types of columns can be declared in the `types` property that maps column names
+    to `int`, `float` or `str`.
     """
 
     def __init__(self, config, component_id):
@@ -198,59 +640,124 @@ class CsvHttpProvider(HttpProvider):
         self.encoding = self.config.value_str("encoding", default="utf-8")
         self.str_decode_unicode = self.config.value("str_decode_unicode", default=True)
         self.delimiter = self.config.value("delimiter", default=";")
+        self.types = self.config.value("types", default={}, required=False)
+        for name, type in self.types.items():
+            if type not in ("int", "float", "str"):
+                raise Exception(
+                    "Invalid type '%s' of the column '%s', the type must be int, float or str!"
+                    % (type, name)
+                )
         self.header = None
         self.lines = None
+        self.index = {}
+        self.columns = []
+
+    def parse(self, data):
+        rows = [
+            row
+            for row in csv.reader(
+                io.StringIO(data.decode(self.encoding)), delimiter=self.delimiter
+            )
+            if len(row) > 0 and "".join(row).strip() != ""
+        ]
+        if len(rows) == 0:
+            raise Exception("The data at %s has no header!" % self.url)
+        header = [
+            unidecode.unidecode(h) if self.str_decode_unicode else h for h in rows[0]
+        ]
+        lines = rows[1:]
+        columns = []
+        for i, values in enumerate(
+            itertools.zip_longest(*lines, fillvalue="")
+            if len(lines) > 0
+            else [()] * len(header)
+        ):
+            if i >= len(header):
+                break
+            type = self.types.get(header[i])
+            type = {"int": int, "float": float, "str": str}[type] if type else None
+            columns.append(self.create_column(header[i], values, type))
+        self.header, self.lines, self.columns = header, lines, columns
+        self.index = {name: i for i, name in enumerate(header)}
+
+    def create_column(self, name, values, type=None):
+        """
+        Converts the column values to the type, the type is detected when it is not declared.
+        Values of str columns are decoded on demand.
+        """
+        declared = type is not None
+        try:
+            type, values = convert_column(values, type)
+        except (ValueError, OverflowError) as e:
+            raise Exception(
+                "The values of the column '%s' cannot be converted to %s! %s"
+                % (name, type.__name__, str(e))
+            )
+        return Map(type=type, values=values, declared=declared, decoded=None)
 
-    def update(self):
-        if super().update():
-            # decode the data
-            s = self.data.decode(self.encoding)
-            if self.str_decode_unicode:
-                s = unidecode.unidecode(s)
-
-            # read csv
-            self.header = None
-            self.lines = []
-            for l in s.split("\r\n"):
-                if self.header is None:
-                    self.header = l.split(self.delimiter)
-                else:
-                    if l.strip() != "":
-                        self.lines.append(l.split(self.delimiter))
-
-            return True
-        else:
-            return False
+    def get_column(self, name):
+        self.update()
+        inx = self.index.get(name)
+        if inx is None or inx >= len(self.columns):
+            raise Exception("The column '%s' does not exist!" % name)
+        column = self.columns[inx]
+        if column.type is str:
+            if not self.str_decode_unicode:
+                return column.values
+            if column.decoded is None:
+                column.decoded = [unidecode.unidecode(v) for v in column.values]
+            return column.decoded
+        return column.values
+
+    def column(self, name):
+        """
+        Returns the values of the column, a NumPy array for numeric columns when NumPy
+        is available or a list.
+        """
+        return self.get_column(name)
 
     def field(self, row_inx, name):
-        def _int_or_float_or_str(v):
-            if isinstance(v, str):
-                try:
-                    return int(v.strip())
-                except:
-                    try:
-                        return float(v.strip())
-                    except:
-                        return v
-            elif isinstance(v, int) or isinstance(v, float):
-                return v
-            else:
-                raise Exception(
-                    "The field value '%s' must be of type int or float! The value was '%s'."
-                    % (name, str(v))
-                )
+        """
+        Returns the value of the column in the row, values of str columns without the declared
+        type are converted to int or float when possible.
+        """
+        values = self.get_column(name)
+        if row_inx >= -len(values) and row_inx < len(values):
+            v = values[row_inx]
+            if isinstance(v, str) and not self.columns[self.index[name]].declared:
+                return to_number(v)
+            return v.item() if hasattr(v, "item") else v
+
+    def aggregate(self, name, func):
+        values = self.get_column(name)
+        if self.columns[self.index[name]].type is str:
+            raise Exception("The column '%s' is not numeric!" % name)
+        if len(values) == 0:
+            return None
+        if np is not None and isinstance(values, np.ndarray):
+            v = getattr(np, func.__name__)(values)
+            # aggregates of arrays of objects are Python values
+            return v.item() if hasattr(v, "item") else v
+        return func(values)
 
-        self.update()
-        col_inx = self.header.index(name)
-        if col_inx >= 0:
-            if abs(row_inx) >= 0 and abs(row_inx) < len(self.lines):
-                return _int_or_float_or_str(self.lines[row_inx][col_inx])
+    def sum(self, name):
+        return self.aggregate(name, sum)
+
+    def min(self, name):
+        return self.aggregate(name, min)
+
+    def max(self, name):
+        return self.aggregate(name, max)
+
+    def last(self, name):
+        return self.field(-1, name)
 
 
 class Event:
     """
     Event object provides a link between a specific pub/sub mechanism (such as MQTT)
-    and yamc providers and collectors.
+    and yamc providers and collectors. The event history is kept in a `RingBuffer`
+    bounded by the provider's `history_max_count` and `history_max_age` settings.
     """
 
     def __init__(self, id, event_provider):
@@ -258,13 +765,16 @@ class Event:
         self.time = 0
         self.data = None
         self.callbacks = []
-        self.history = []
+        self.history = RingBuffer(
+            max_count=event_provider.history_max_count,
+            max_age=event_provider.history_max_age,
+        )
         self.provider = event_provider
 
     def update(self, data):
         self.time = time.time()
         self.data = data
-        self.history.append(data)
+        self.history.append(data, self.time)
         self.provider.update(self)
         for callback in self.callbacks:
             callback(self)
@@ -280,6 +790,10 @@ class EventProvider(BaseProvider):
 
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
+        self.history_max_count = self.config.value_int(
+            "history_max_count", default=100, min=1
+        )
+        self.history_max_age = self.config.value("history_max_age", default=None)
         self.events = Map()
         for e in self.config.value("events"):
             self.add_event(e)
@@ -323,7 +837,7 @@ class EventProvider(BaseProvider):
             self.data = Map()
         if event is None:
             for e in self.events.values():
-                self.data[e.id] = Map(time=e.time, data=e.data)
+                self.data[e.id] = Record(time=e.time, data=e.data)
         else:
-            self.data[event.id] = Map(time=event.time, data=event.data)
+            self.data[event.id] = Record(time=event.time, data=event.data)
         return True
@@ -9,8 +9,37 @@ import string
 import re
 import time
 import threading
+import operator
 
 from functools import reduce
+from collections import ChainMap
+
+# expressions that only access a variable or its attributes, such as event.data.battery
+ATTR_PATH_PATTERN = re.compile(
+    r"^\s*([A-Za-z_][A-Za-z0-9_]*)((\.[A-Za-z_][A-Za-z0-9_]*)*)\s*$"
+)
+
+
+class Scope(ChainMap):
+    """
+    Layered scope to evaluate Python expressions. The first layer holds variables of a single
+    evaluation such as the event or the data, the last layer is the global scope that is shared
+    by all evaluations and must be a dict. Expressions are evaluated with the global layer as
+    globals and the first layer as locals so that no layer is copied.
+    """
+
+    def __init__(self, local=None, globals=None):
+        super().__init__(
+            local if local is not None else {}, globals if globals is not None else {}
+        )
+
+    @property
+    def local(self):
+        return self.maps[0]
+
+    @property
+    def globals(self):
+        return self.maps[-1]
 
 
 class PythonExpression:
@@ -19,10 +48,31 @@ class PythonExpression:
         self.expr = self.compile()
 
     def compile(self):
+        # trivial expressions are evaluated by a direct attribute getter instead of eval
+        m = ATTR_PATH_PATTERN.match(self.expr_str)
+        self.getter = None
+        if m:
+            self.getter = (
+                m.group(1),
+                operator.attrgetter(m.group(2)[1:]) if m.group(2) else None,
+            )
         return compile(self.expr_str, "<string>", "eval")
 
     def eval(self, scope):
-        return eval(self.expr, {}, scope)
+        if isinstance(scope, Scope):
+            _globals, _locals = scope.globals, scope.local
+        else:
+            _globals, _locals = {}, scope
+        if self.getter is not None:
+            name, attrs = self.getter
+            if name in _locals:
+                v = _locals[name]
+            elif name in _globals:
+                v = _globals[name]
+            else:
+                return eval(self.expr, _globals, _locals)
+            return attrs(v) if attrs is not None else v
+        return eval(self.expr, _globals, _locals)
 
     def __getstate__(self):
         return (self.expr_str, None)
@@ -61,6 +111,9 @@ class Map(dict):
                     self[k] = v
 
     def __getattr__(self, attr):
+        # special attributes such as __setstate__ must not resolve to None, otherwise pickle fails
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
         a = self.get(attr)
         if a is None and not MAP_IGNORE_KEY_ERROR:
             raise KeyError(f'The key "{attr}" is undefined!')
@@ -103,6 +156,291 @@ class Map(dict):
         return data
 
 
+class Record(dict):
+    """
+    Lightweight dict with the attribute access of `Map`. Unlike `Map`, it does not mirror its keys
+    in `__dict__` and it does not copy nested dicts on construction; a nested dict is converted
+    to a `Record` when it is first accessed as an attribute.
+    """
+
+    __slots__ = ()
+
+    def __getattribute__(self, attr):
+        # keys take precedence over dict methods the same way as in Map
+        if attr in self:
+            a = self[attr]
+            if type(a) is dict:
+                a = self[attr] = Record(a)
+            elif a is None and not MAP_IGNORE_KEY_ERROR:
+                raise KeyError(f'The key "{attr}" is undefined!')
+            return a
+        return dict.__getattribute__(self, attr)
+
+    def __getattr__(self, attr):
+        # special attributes such as __setstate__ must not resolve to None, otherwise pickle fails
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+        if not MAP_IGNORE_KEY_ERROR:
+            raise KeyError(f'The key "{attr}" is undefined!')
+        return None
+
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+
+class RingBuffer:
+    """
+    Bounded, time-indexed ring buffer. Items are stored with their timestamps in
+    preallocated slots; the oldest items are overwritten when `max_count` is reached
+    and expired once they are older than `max_age` seconds. Timestamps must be
+    non-decreasing so that time-range lookups can use binary search.
+    """
+
+    def __init__(self, max_count=None, max_age=None, capacity=16):
+        if max_count is not None and max_count < 1:
+            raise Exception("The max_count of the ring buffer must be greater than 0!")
+        self.max_count = max_count
+        self.max_age = max_age
+        if max_count is not None:
+            capacity = min(capacity, max_count)
+        self._items = [None] * capacity
+        self._times = [0] * capacity
+        self._head = 0
+        self._len = 0
+        # sequence number of the oldest item, used by views to detect overwritten items
+        self._seq = 0
+
+    def _grow(self):
+        capacity = len(self._items)
+        new_capacity = capacity * 2
+        if self.max_count is not None:
+            new_capacity = min(new_capacity, self.max_count)
+        items, times = [None] * new_capacity, [0] * new_capacity
+        for i in range(self._len):
+            p = (self._head + i) % capacity
+            items[i], times[i] = self._items[p], self._times[p]
+        self._items, self._times, self._head = items, times, 0
+
+    def _pop_oldest(self):
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._len -= 1
+        self._seq += 1
+
+    def _physical(self, inx):
+        if inx < 0:
+            inx += self._len
+        if inx < 0 or inx >= self._len:
+            raise IndexError("The ring buffer index out of range!")
+        return (self._head + inx) % len(self._items)
+
+    def append(self, item, t=None):
+        """
+        Appends the item with the timestamp `t` (the current time by default).
+        """
+        t = time.time() if t is None else t
+        if self._len == len(self._items):
+            if self.max_count is not None and self._len >= self.max_count:
+                self._pop_oldest()
+            else:
+                self._grow()
+        p = (self._head + self._len) % len(self._items)
+        self._items[p], self._times[p] = item, t
+        self._len += 1
+        if self.max_age is not None:
+            self.expire(t)
+
+    def expire(self, now=None):
+        """
+        Removes items that are older than `max_age` seconds.
+        """
+        if self.max_age is not None:
+            limit = (time.time() if now is None else now) - self.max_age
+            while self._len > 0 and self._times[self._head] < limit:
+                self._pop_oldest()
+
+    def clear(self):
+        while self._len > 0:
+            self._pop_oldest()
+
+    def time(self, inx):
+        """
+        Returns the timestamp of the item at the index `inx`.
+        """
+        return self._times[self._physical(inx)]
+
+    def bisect(self, t):
+        """
+        Returns the index of the first item with the timestamp greater or equal to `t`.
+        """
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._times[(self._head + mid) % len(self._items)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def since(self, t):
+        """
+        Returns a view of items with the timestamp greater or equal to `t`.
+        """
+        return RingBufferView(self, self._seq + self.bisect(t), self._seq + self._len)
+
+    def between(self, t1, t2):
+        """
+        Returns a view of items with the timestamp in the interval [`t1`, `t2`).
+        """
+        return RingBufferView(
+            self, self._seq + self.bisect(t1), self._seq + self.bisect(t2)
+        )
+
+    def last(self, n):
+        """
+        Returns a view of the last `n` items.
+        """
+        n = max(0, min(n, self._len))
+        return RingBufferView(self, self._seq + self._len - n, self._seq + self._len)
+
+    def entries(self):
+        """
+        Iterates over (time, item) tuples from the oldest to the newest item.
+        """
+        for i in range(self._len):
+            p = (self._head + i) % len(self._items)
+            yield self._times[p], self._items[p]
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for i in range(self._len):
+            yield self._items[(self._head + i) % len(self._items)]
+
+    def __getitem__(self, inx):
+        if isinstance(inx, slice):
+            return [self[i] for i in range(*inx.indices(self._len))]
+        return self._items[self._physical(inx)]
+
+    def __repr__(self):
+        return "RingBuffer(%s)" % str(list(self))
+
+
+class RingBufferView:
+    """
+    A view of a range of items in the `RingBuffer`. The view does not copy the items;
+    items that were overwritten or expired after the view was created cannot be accessed.
+    """
+
+    def __init__(self, buffer, start, stop):
+        self.buffer = buffer
+        self.start = start
+        self.stop = stop
+
+    def _physical(self, inx):
+        if inx < 0:
+            inx += len(self)
+        if inx < 0 or inx >= len(self):
+            raise IndexError("The ring buffer view index out of range!")
+        offset = self.start + inx - self.buffer._seq
+        if offset < 0:
+            raise IndexError("The item was removed from the ring buffer!")
+        return self.buffer._physical(offset)
+
+    def times(self):
+        return [self.buffer._times[self._physical(i)] for i in range(len(self))]
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.buffer._items[self._physical(i)]
+
+    def __getitem__(self, inx):
+        if isinstance(inx, slice):
+            return [self[i] for i in range(*inx.indices(len(self)))]
+        return self.buffer._items[self._physical(inx)]
+
+    def __repr__(self):
+        return "RingBufferView(%s)" % str(list(self))
+
+
+class EvalPlan:
+    """
+    Evaluation plan of a structure of dicts and lists with Python expressions. The structure is
+    compiled to a single code object that evaluates all expressions and builds the result in one
+    call; constant parts of the structure are embedded in the code as literals. Similarly to
+    `deep_eval`, an expression that fails results in None.
+    """
+
+    LITERALS = (str, int, float, bool, type(None))
+
+    def __init__(self, data):
+        self.data = data
+        self.consts = []
+        self.exprs = []
+        lines = ["__e = []"]
+        result = self._source(data, lines)
+        lines.append("__r = " + result)
+        self.code = compile("\n".join(lines), "<plan>", "exec")
+
+    def _source(self, data, lines):
+        if isinstance(data, dict):
+            return (
+                "{"
+                + ", ".join(
+                    [
+                        "%s: %s" % (self._const(k), self._source(v, lines))
+                        for k, v in data.items()
+                    ]
+                )
+                + "}"
+            )
+        elif isinstance(data, list):
+            return "[" + ", ".join([self._source(x, lines) for x in data]) + "]"
+        elif isinstance(data, PythonExpression):
+            inx = len(self.exprs)
+            self.exprs.append(data)
+            lines += [
+                "try:",
+                "    __v%d = (\n%s\n)" % (inx, data.expr_str),
+                "except Exception as __x:",
+                "    __v%d = None" % inx,
+                "    __e.append((%d, __x))" % inx,
+            ]
+            return "__v%d" % inx
+        return self._const(data)
+
+    def _const(self, value):
+        if isinstance(value, self.LITERALS) and (
+            not isinstance(value, float)
+            or value == value
+            and abs(value) != float("inf")
+        ):
+            return repr(value)
+        # other constants are hoisted to the table of constants
+        self.consts.append(value)
+        return "__c[%d]" % (len(self.consts) - 1)
+
+    def eval(self, scope, log=None, raise_ex=False):
+        if isinstance(scope, Scope):
+            # the first layer of the scope is small, it is copied to hold the plan's variables
+            ns = dict(scope.local)
+            ns["__c"] = self.consts
+            exec(self.code, scope.globals, ns)
+        else:
+            ns = {"__c": self.consts}
+            exec(self.code, {}, ChainMap(ns, scope))
+        for inx, e in ns["__e"]:
+            if log is not None:
+                log.error("The Python expression failed. %s." % (str(e)))
+            if raise_ex:
+                raise e
+        return ns["__r"]
+
+
 def deep_eval(data, scope, log=None, raise_ex=False):
     if isinstance(data, dict):
         for key, value in data.items():
@@ -186,3 +524,13 @@ def merge_dicts(*dicts):
         if d is not None:
             result.update(d)
     return result
+
+
+def backoff_delay(attempt, initial, maximum):
+    """
+    Returns the delay before the retry `attempt` (starting from 0) with exponential backoff
+    and jitter. The delay is between a half and the whole of `initial * 2**attempt`, capped
+    by `maximum`.
+    """
+    delay = min(maximum, initial * 2**attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,925 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+import struct
+import pickle
+import threading
+import zlib
+import bisect
+import logging
+import json
+import marshal
+
+from yamc.utils import Map, Record
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+# block header: codec, base offset, number of items, payload length, payload crc32
+BLOCK_HEADER = struct.Struct("<BQIII")
+
+# the codec of the block payload is the format in the lower 4 bits and the compression in the upper 4 bits
+FORMAT_PICKLE = 0
+# the compact format serialized with marshal whose format can change between Python versions,
+# blocks in this format are only read
+FORMAT_MARSHAL = 1
+FORMAT_COMPACT = 2
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_LZ4 = 2
+
+FORMATS = {"pickle": FORMAT_PICKLE, "compact": FORMAT_COMPACT}
+COMPRESSIONS = {
+    "none": COMPRESSION_NONE,
+    "zlib": COMPRESSION_ZLIB,
+    "lz4": COMPRESSION_LZ4,
+}
+
+SEGMENT_PATTERN = "segment_([0-9]{20}).log$"
+INDEX_FILE = "index"
+# the cursor file of the backlog created before the index was introduced
+CURSOR_FILE = "cursor"
+
+# the pickle protocol of blocks, it is fixed so that the blocks can be read by other Python versions
+PICKLE_PROTOCOL = 4
+
+FSYNC_POLICIES = ["always", "interval", "never"]
+EVICTION_POLICIES = ["drop_oldest", "drop_newest", "downsample"]
+
+
+class BlockCodec:
+    """
+    Encodes blocks of backlog items. The `compact` format replaces keys of dicts with references
+    to a table of key tuples (shapes) that is shared by all items in the block and serializes the
+    result with `pickle`. Blocks are serialized with the fixed pickle protocol so that they can be
+    read after the Python upgrade. Blocks can be compressed with zlib or lz4; blocks in any format
+    and compression can be decoded regardless of the codec configuration.
+    """
+
+    def __init__(self, format="compact", compression="zlib", compression_level=1):
+        if format not in FORMATS:
+            raise Exception(
+                "Invalid backlog format '%s', the format must be one of %s!"
+                % (format, ", ".join(FORMATS.keys()))
+            )
+        if compression not in COMPRESSIONS:
+            raise Exception(
+                "Invalid backlog compression '%s', the compression must be one of %s!"
+                % (compression, ", ".join(COMPRESSIONS.keys()))
+            )
+        if compression == "lz4" and lz4 is None:
+            raise Exception("The lz4 compression requires the lz4 package!")
+        self.format = FORMATS[format]
+        self.compression = COMPRESSIONS[compression]
+        self.compression_level = compression_level
+
+    @staticmethod
+    def pack(value, shapes, shape_ids):
+        if isinstance(value, dict):
+            keys = tuple(value.keys())
+            sid = shape_ids.get(keys)
+            if sid is None:
+                sid = shape_ids[keys] = len(shapes)
+                shapes.append(keys)
+            return (
+                sid,
+                [BlockCodec.pack(v, shapes, shape_ids) for v in value.values()],
+            )
+        elif isinstance(value, list):
+            return [BlockCodec.pack(v, shapes, shape_ids) for v in value]
+        elif isinstance(value, tuple):
+            return (-1, [BlockCodec.pack(v, shapes, shape_ids) for v in value])
+        return value
+
+    @staticmethod
+    def unpack(value, shapes):
+        if isinstance(value, tuple):
+            if value[0] < 0:
+                return tuple([BlockCodec.unpack(v, shapes) for v in value[1]])
+            return Record(
+                zip(shapes[value[0]], [BlockCodec.unpack(v, shapes) for v in value[1]])
+            )
+        elif isinstance(value, list):
+            return [BlockCodec.unpack(v, shapes) for v in value]
+        return value
+
+    def encode(self, items):
+        """
+        Encodes the items and returns the codec and the payload of the block.
+        """
+        if self.format == FORMAT_COMPACT:
+            shapes, shape_ids = [], {}
+            packed = [self.pack(x, shapes, shape_ids) for x in items]
+            payload = pickle.dumps((shapes, packed), protocol=PICKLE_PROTOCOL)
+        else:
+            payload = pickle.dumps(items, protocol=PICKLE_PROTOCOL)
+        if self.compression == COMPRESSION_ZLIB:
+            payload = zlib.compress(payload, self.compression_level)
+        elif self.compression == COMPRESSION_LZ4:
+            payload = lz4.frame.compress(payload)
+        return self.format | (self.compression << 4), payload
+
+    def decode(self, codec, payload):
+        """
+        Decodes the payload of the block and returns the list of items.
+        """
+        format, compression = codec & 0x0F, codec >> 4
+        if compression == COMPRESSION_ZLIB:
+            payload = zlib.decompress(payload)
+        elif compression == COMPRESSION_LZ4:
+            if lz4 is None:
+                raise Exception("The lz4 package is required to read the backlog!")
+            payload = lz4.frame.decompress(payload)
+        elif compression != COMPRESSION_NONE:
+            raise Exception(
+                "Unknown compression %d of the backlog block!" % compression
+            )
+        if format == FORMAT_PICKLE:
+            return pickle.loads(payload)
+        elif format == FORMAT_COMPACT:
+            shapes, packed = pickle.loads(payload)
+            return [self.unpack(x, shapes) for x in packed]
+        elif format == FORMAT_MARSHAL:
+            try:
+                shapes, packed = marshal.loads(payload)
+            except (ValueError, EOFError, TypeError) as e:
+                raise Exception(
+                    "The backlog block was written by another Python version and cannot be read! %s"
+                    % str(e)
+                )
+            return [self.unpack(x, shapes) for x in packed]
+        raise Exception("Unknown format %d of the backlog block!" % format)
+
+
+class Segment:
+    """
+    A segment file of the `SegmentLog`. The segment stores blocks of items, the segment
+    name is the offset of the first item in the segment. The `seq` is the sequence number
+    of the segment in the log, the `level` is the number of times the segment was downsampled.
+    """
+
+    def __init__(self, log_dir, base_offset, seq=0):
+        self.base_offset = base_offset
+        self.seq = seq
+        self.path = os.path.join(log_dir, "segment_%020d.log" % base_offset)
+        self.count = 0
+        self.size = 0
+        self.first_time = 0
+        self.last_time = 0
+        self.level = 0
+
+    @property
+    def end_offset(self):
+        return self.base_offset + self.count
+
+    def to_dict(self):
+        return dict(
+            seq=self.seq,
+            base_offset=self.base_offset,
+            count=self.count,
+            size=self.size,
+            first_time=self.first_time,
+            last_time=self.last_time,
+            level=self.level,
+        )
+
+    @staticmethod
+    def from_dict(log_dir, d):
+        segment = Segment(log_dir, d["base_offset"], d["seq"])
+        segment.count, segment.size = d["count"], d["size"]
+        segment.first_time = d.get("first_time", 0)
+        segment.last_time = d.get("last_time", 0)
+        segment.level = d.get("level", 0)
+        return segment
+
+    def scan(self, log, pos=0):
+        """
+        Reads the segment's blocks from the position `pos`, updates the number of items and the size
+        of the segment and truncates the segment after the last valid block.
+        """
+        if pos == 0:
+            self.count = 0
+        self.size = pos
+        with open(self.path, "rb") as f:
+            for pos, codec, offset, count, payload in read_blocks(f, pos):
+                if offset != self.base_offset + self.count:
+                    log.error(
+                        "The block at position %d in %s has an unexpected offset %d."
+                        % (pos, self.path, offset)
+                    )
+                    break
+                self.count += count
+                self.size = f.tell()
+        if self.last_time == 0:
+            self.last_time = os.path.getmtime(self.path)
+            self.first_time = self.last_time
+        if self.size < os.path.getsize(self.path):
+            log.warning(
+                "The segment %s contains an incomplete block at position %d, it will be truncated."
+                % (self.path, self.size)
+            )
+            with open(self.path, "r+b") as f:
+                f.truncate(self.size)
+
+
+def read_blocks(f, pos=0):
+    """
+    Iterates over valid blocks in the segment file `f` starting at the position `pos`. It yields
+    tuples (position, codec, base offset, number of items, payload) and stops at the first incomplete
+    or corrupted block.
+    """
+    f.seek(pos)
+    while True:
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            break
+        codec, offset, count, length, crc = BLOCK_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break
+        yield pos, codec, offset, count, payload
+        pos += BLOCK_HEADER.size + length
+
+
+class SegmentLog:
+    """
+    Segmented append-only log of items. Items are appended in blocks to fixed-size segment files
+    and are addressed by sequential offsets. The committed offset (the cursor) is the offset of the
+    first item that has not been consumed yet; segments that only contain consumed items are deleted
+    and partially consumed segments are compacted when the log is opened. The segments and the
+    committed offset are recorded in the index so that opening the log does not need to read the
+    segments. Blocks hold at most `block_items` items so that reading from a large block does not
+    decode more than a block at a time.
+    """
+
+    def __init__(
+        self,
+        log_dir,
+        segment_size=4 * 1024 * 1024,
+        fsync="interval",
+        fsync_interval=1,
+        compact_ratio=0.5,
+        block_items=1000,
+        codec=None,
+        log=None,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise Exception(
+                "Invalid fsync policy '%s', the policy must be one of %s!"
+                % (fsync, ", ".join(FSYNC_POLICIES))
+            )
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.block_items = block_items
+        self.codec = codec if codec is not None else BlockCodec()
+        self.log = log if log is not None else logging.getLogger("backlog")
+        self.lock = threading.RLock()
+        self.segments = []
+        self.committed = 0
+        self.next_seq = 0
+        # the committed offset that was written to the index
+        self._index_committed = 0
+        self._file = None
+        self._last_fsync = 0
+        self._pending_sync = False
+        # cached read position (segment, file position, offset of the block at the position)
+        self._read_pos = None
+        # the offset after the last item returned by read
+        self._read_end = 0
+        # the last decoded block (segment, offset of the block, items)
+        self._block = None
+        self.open()
+
+    @property
+    def start_offset(self):
+        return (
+            self.segments[0].base_offset if len(self.segments) > 0 else self.committed
+        )
+
+    @property
+    def end_offset(self):
+        return (
+            self.segments[-1].end_offset if len(self.segments) > 0 else self.committed
+        )
+
+    def open(self):
+        """
+        Opens the log by reading the index. The segments are scanned only when the index does
+        not exist or does not match the segment files.
+        """
+        with self.lock:
+            self._close_file()
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._read_pos = None
+            self._block = None
+            if not self.read_index():
+                self.scan_segments()
+            if len(self.segments) > 0 and self.committed < self.start_offset:
+                self.committed = self.start_offset
+            self.committed = min(self.committed, self.end_offset)
+            self._index_committed = self.committed
+            self.compact(partial=True)
+            self.write_index()
+            if os.path.exists(os.path.join(self.log_dir, CURSOR_FILE)):
+                os.remove(os.path.join(self.log_dir, CURSOR_FILE))
+
+    def read_index(self):
+        """
+        Reads the segments and the committed offset from the index. Only the last segment is scanned
+        for blocks appended after the index was written. Returns False when the index cannot be used.
+        """
+        try:
+            with open(os.path.join(self.log_dir, INDEX_FILE), "r") as f:
+                index = json.load(f)
+            segments = [Segment.from_dict(self.log_dir, x) for x in index["segments"]]
+            for segment in segments:
+                if (
+                    not os.path.exists(segment.path)
+                    or os.path.getsize(segment.path) < segment.size
+                ):
+                    self.log.warning(
+                        "The backlog index does not match the segment %s, the segments will be scanned."
+                        % segment.path
+                    )
+                    return False
+            if (
+                len(segments) > 0
+                and os.path.getsize(segments[-1].path) > segments[-1].size
+            ):
+                segments[-1].scan(self.log, segments[-1].size)
+            self.segments = segments
+            self.committed = index["committed"]
+            self.next_seq = index["next_seq"]
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            self.log.error(
+                "Cannot read the backlog index, the segments will be scanned. %s"
+                % str(e)
+            )
+            return False
+
+    def write_index(self):
+        file = os.path.join(self.log_dir, INDEX_FILE)
+        with open(file + ".tmp", "w") as f:
+            json.dump(
+                dict(
+                    committed=self._index_committed,
+                    next_seq=self.next_seq,
+                    segments=[s.to_dict() for s in self.segments],
+                ),
+                f,
+            )
+            if self.fsync != "never":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(file + ".tmp", file)
+
+    def scan_segments(self):
+        """
+        Reads the segments and the committed offset by scanning the segment files.
+        """
+        self.segments = []
+        for name in sorted(os.listdir(self.log_dir)):
+            m = re.match(SEGMENT_PATTERN, name)
+            if m:
+                segment = Segment(self.log_dir, int(m.group(1)), len(self.segments))
+                segment.scan(self.log)
+                self.segments.append(segment)
+        self.next_seq = len(self.segments)
+        self.committed = self.read_cursor()
+
+    def read_cursor(self):
+        try:
+            with open(os.path.join(self.log_dir, CURSOR_FILE), "r") as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            self.log.error(
+                "Cannot read the backlog cursor, the backlog will be read from the beginning. %s"
+                % str(e)
+            )
+            return 0
+
+    def _active_file(self, size=0):
+        """
+        Returns the file of the active segment. A new segment is created when the block of `size`
+        bytes would exceed the `segment_size` of the active segment that is not empty.
+        """
+        if len(self.segments) == 0 or (
+            self.segments[-1].size > 0
+            and self.segments[-1].size + max(size, 1) > self.segment_size
+        ):
+            self._close_file()
+            segment = Segment(self.log_dir, self.end_offset, self.next_seq)
+            self._file = open(segment.path, "ab", buffering=0)
+            self.segments.append(segment)
+            self.next_seq += 1
+            self.write_index()
+        if self._file is None:
+            self._file = open(self.segments[-1].path, "ab", buffering=0)
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            if self._pending_sync:
+                os.fsync(self._file.fileno())
+                self._pending_sync = False
+            self._file.close()
+            self._file = None
+
+    def sync(self, force=False):
+        """
+        Flushes the active segment to the disk according to the fsync policy. The `interval`
+        policy groups all appends within `fsync_interval` seconds into a single fsync.
+        """
+        with self.lock:
+            if self._file is None or not self._pending_sync:
+                return
+            if (
+                force
+                or self.fsync == "always"
+                or (
+                    self.fsync == "interval"
+                    and time.time() - self._last_fsync >= self.fsync_interval
+                )
+            ):
+                os.fsync(self._file.fileno())
+                self._last_fsync = time.time()
+                self._pending_sync = False
+
+    def blocks(self, items, offset):
+        """
+        Encodes the items to blocks of at most `block_items` items starting at the `offset`.
+        """
+        for i in range(0, len(items), self.block_items):
+            block = items[i : i + self.block_items]
+            codec, payload = self.codec.encode(block)
+            yield len(block), BLOCK_HEADER.pack(
+                codec, offset + i, len(block), len(payload), zlib.crc32(payload)
+            ) + payload
+
+    def append(self, items):
+        """
+        Appends the items to the log and returns the offset of the first item.
+        """
+        if len(items) == 0:
+            return self.end_offset
+        with self.lock:
+            offset = self.end_offset
+            for count, block in self.blocks(items, offset):
+                f = self._active_file(len(block))
+                segment = self.segments[-1]
+                segment.last_time = time.time()
+                if segment.first_time == 0:
+                    segment.first_time = segment.last_time
+                f.write(block)
+                segment.count += count
+                segment.size += len(block)
+            self._pending_sync = self.fsync != "never"
+            self.sync()
+            return offset
+
+    def _find_segment(self, offset):
+        inx = bisect.bisect_right([s.base_offset for s in self.segments], offset) - 1
+        return self.segments[inx] if inx >= 0 else None
+
+    def _seek(self, offset):
+        """
+        Returns the offset of the first item at or after the `offset`. Offsets may have gaps
+        when segments were downsampled.
+        """
+        for segment in self.segments:
+            if offset < segment.end_offset:
+                return max(offset, segment.base_offset)
+        return offset
+
+    def read(self, max_items, offset=None):
+        """
+        Reads at most `max_items` items starting at the `offset` (the committed offset by default).
+        It returns the offset of the next item to read and the list of items.
+        """
+        with self.lock:
+            offset = self.committed if offset is None else offset
+            items = []
+            while len(items) < max_items and offset < self.end_offset:
+                offset = self._seek(offset)
+                if self._block is not None:
+                    segment, block_offset, data = self._block
+                    if (
+                        segment in self.segments
+                        and block_offset <= offset < block_offset + len(data)
+                    ):
+                        take = data[
+                            offset
+                            - block_offset : offset
+                            - block_offset
+                            + max_items
+                            - len(items)
+                        ]
+                        items += take
+                        offset += len(take)
+                        continue
+                segment, pos, block_offset = None, 0, None
+                if self._read_pos is not None:
+                    segment, pos, block_offset = self._read_pos
+                    if (
+                        segment not in self.segments
+                        or block_offset > offset
+                        or offset >= segment.end_offset
+                    ):
+                        segment = None
+                if segment is None:
+                    segment, pos = self._find_segment(offset), 0
+                    if segment is None:
+                        break
+                with open(segment.path, "rb") as f:
+                    for pos, codec, block_offset, count, payload in read_blocks(f, pos):
+                        if block_offset + count <= offset:
+                            continue
+                        self._read_pos = (segment, pos, block_offset)
+                        data = self.codec.decode(codec, payload)
+                        self._block = (segment, block_offset, data)
+                        take = data[
+                            offset
+                            - block_offset : offset
+                            - block_offset
+                            + max_items
+                            - len(items)
+                        ]
+                        items += take
+                        offset += len(take)
+                        if len(items) >= max_items:
+                            break
+                if offset < segment.end_offset and len(items) < max_items:
+                    self.log.error(
+                        "The backlog segment %s is corrupted, the items at offsets %d-%d are lost."
+                        % (segment.path, offset, segment.end_offset)
+                    )
+                    offset = segment.end_offset
+            self._read_end = offset
+            return offset, items
+
+    def commit(self, offset, persist=True):
+        """
+        Marks all items before the `offset` as consumed.
+        """
+        with self.lock:
+            self.committed = max(self.committed, min(offset, self.end_offset))
+            if persist:
+                self._index_committed = self.committed
+                self.write_index()
+                if self.compact():
+                    self.write_index()
+
+    def compact(self, partial=False):
+        """
+        Deletes segments with consumed items only. When `partial` is set, it also rewrites the oldest
+        sealed segment when the ratio of its consumed items exceeds `compact_ratio`; this is only done
+        when the log is opened since the oldest segment is the segment that is being consumed.
+        Returns True when the segments changed.
+        """
+        with self.lock:
+            changed = False
+            while (
+                len(self.segments) > 0 and self.segments[0].end_offset <= self.committed
+            ):
+                segment = self.segments.pop(0)
+                if len(self.segments) == 0:
+                    self._close_file()
+                os.remove(segment.path)
+                self.log.debug("The backlog segment %s was removed." % segment.path)
+                changed = True
+            if partial and len(self.segments) > 1:
+                segment = self.segments[0]
+                consumed = self.committed - segment.base_offset
+                if segment.count > 0 and consumed / segment.count > self.compact_ratio:
+                    self.rewrite(segment)
+                    changed = True
+            return changed
+
+    def rewrite(self, segment, keep=None):
+        """
+        Rewrites the segment with its unconsumed items. When `keep` is set, only the items for
+        which `keep(item)` returns True are retained. Returns the number of removed items.
+        """
+        with self.lock:
+            start = max(self.committed, segment.base_offset)
+            _, items = self.read(segment.end_offset - start, offset=start)
+            kept = items if keep is None else [x for x in items if keep(x)]
+            rewritten = Segment(self.log_dir, start, segment.seq)
+            rewritten.first_time = segment.first_time
+            rewritten.last_time = segment.last_time
+            rewritten.level = segment.level
+            if segment is self.segments[-1]:
+                self._close_file()
+            with open(rewritten.path + ".tmp", "wb") as f:
+                for count, block in self.blocks(kept, start):
+                    f.write(block)
+                    rewritten.count += count
+                    rewritten.size += len(block)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(rewritten.path + ".tmp", rewritten.path)
+            if rewritten.path != segment.path:
+                os.remove(segment.path)
+            self.segments[self.segments.index(segment)] = rewritten
+            self._read_pos = None
+            self._block = None
+            self.write_index()
+            self.log.debug(
+                "The backlog segment %s was rewritten to %s, %d items were removed."
+                % (segment.path, rewritten.path, len(items) - len(kept))
+            )
+            return len(items) - len(kept)
+
+    def live_count(self, segment):
+        """
+        Returns the number of unconsumed items in the segment.
+        """
+        return max(0, segment.end_offset - max(self.committed, segment.base_offset))
+
+    def drop(self, count):
+        """
+        Marks the `count` oldest unconsumed items as consumed. Returns the number of dropped items.
+        """
+        with self.lock:
+            offset, dropped = self.committed, 0
+            for segment in self.segments:
+                if dropped >= count:
+                    break
+                start = max(offset, segment.base_offset)
+                n = min(count - dropped, max(0, segment.end_offset - start))
+                dropped += n
+                offset = start + n
+            self.commit(offset)
+            return dropped
+
+    def drop_segment(self):
+        """
+        Marks all items of the oldest segment as consumed. Returns the number of dropped items.
+        """
+        with self.lock:
+            count = self.live_count(self.segments[0])
+            self.commit(self.segments[0].end_offset)
+            return count
+
+    def size(self):
+        with self.lock:
+            return sum([self.live_count(s) for s in self.segments])
+
+    def disk_size(self):
+        return sum([s.size for s in self.segments])
+
+    def close(self):
+        with self.lock:
+            self._close_file()
+            self.write_index()
+
+
+class Backlog:
+    """
+    Writer's backlog of items that could not be written to the writer's destination. The items are
+    stored in the `SegmentLog` in the writer's backlog directory and are replayed in batches of
+    `batch_size` items when the writer becomes healthy. The backlog can be limited by the number
+    of items, the size on disk and the age of items; the `eviction` policy determines which items
+    are evicted when the limits are exceeded.
+    """
+
+    def __init__(self, writer, config):
+        self.writer = writer
+        self.config = config
+        self.log = writer.log
+        self.backlog_dir = config.get_dir_path(
+            config.data_dir + "/backlog/" + self.writer.component_id
+        )
+        os.makedirs(self.backlog_dir, exist_ok=True)
+        self.segment_log = SegmentLog(
+            self.backlog_dir,
+            segment_size=writer.config.value_int(
+                "backlog.segment_size", default=4 * 1024 * 1024
+            ),
+            fsync=writer.config.value_str("backlog.fsync", default="interval"),
+            fsync_interval=writer.config.value("backlog.fsync_interval", default=1),
+            compact_ratio=writer.config.value("backlog.compact_ratio", default=0.5),
+            block_items=max(1, writer.batch_size),
+            codec=BlockCodec(
+                format=writer.config.value_str("backlog.format", default="compact"),
+                compression=writer.config.value_str(
+                    "backlog.compression", default="zlib"
+                ),
+                compression_level=writer.config.value_int(
+                    "backlog.compression_level", default=1
+                ),
+            ),
+            log=self.log,
+        )
+        self.max_items = writer.config.value_int("backlog.max_items", default=None)
+        self.max_bytes = writer.config.value_int("backlog.max_bytes", default=None)
+        self.max_age = writer.config.value("backlog.max_age", default=None)
+        self.eviction = writer.config.value_str(
+            "backlog.eviction", default="drop_oldest"
+        )
+        if self.eviction not in EVICTION_POLICIES:
+            raise Exception(
+                "Invalid backlog eviction policy '%s', the policy must be one of %s!"
+                % (self.eviction, ", ".join(EVICTION_POLICIES))
+            )
+        self.evicted = Map(oldest=0, newest=0, downsampled=0, expired=0)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Imports items from backlog files created by previous yamc versions to the log.
+        """
+        files = [
+            f
+            for f in os.listdir(self.backlog_dir)
+            if re.match("items_[a-zA-Z0-9]+.data$", f)
+        ]
+        if len(files) > 0:
+            if self.writer.args.test:
+                self.log.info(
+                    "Running in test mode, %d backlog files will not be imported to the backlog."
+                    % len(files)
+                )
+                return
+            files.sort(
+                key=lambda x: os.path.getmtime(os.path.join(self.backlog_dir, x))
+            )
+            self.log.info("Importing %d backlog files to the backlog." % len(files))
+            for file in files:
+                with open(os.path.join(self.backlog_dir, file), "rb") as f:
+                    self.segment_log.append(pickle.load(f))
+            self.segment_log.sync(force=True)
+            for file in files:
+                os.remove(os.path.join(self.backlog_dir, file))
+
+    def put(self, items):
+        if self.writer.args.test:
+            self.log.info("Running in test mode, the backlog item will not be created")
+        else:
+            if self.eviction == "drop_newest":
+                items = self.admit(items)
+            self.segment_log.append(items)
+            self.enforce_limits()
+            self.log.debug(
+                "Writing data to the writer's backlog. The backlog size is %d."
+                % (self.size())
+            )
+
+    def over_limit(self):
+        return (self.max_items is not None and self.size() > self.max_items) or (
+            self.max_bytes is not None and self.segment_log.disk_size() > self.max_bytes
+        )
+
+    def admit(self, items):
+        """
+        Returns the items that fit in the backlog limits, the remaining items are evicted.
+        """
+        free = len(items)
+        if self.max_items is not None:
+            free = min(free, max(0, self.max_items - self.size()))
+        if (
+            self.max_bytes is not None
+            and self.segment_log.disk_size() >= self.max_bytes
+        ):
+            free = 0
+        if free < len(items):
+            self.evicted.newest += len(items) - free
+            self.log.warning(
+                "The backlog is full, %d new items were evicted. The number of evicted items is %s."
+                % (len(items) - free, str(dict(self.evicted)))
+            )
+        return items[:free]
+
+    def downsample(self):
+        """
+        Removes every second item of each collector from the oldest sealed segment that was downsampled
+        the least number of times. Returns False when there is no segment to downsample.
+        """
+        log = self.segment_log
+        with log.lock:
+            candidates = [
+                s
+                for s in log.segments[:-1]
+                if s.base_offset >= max(log.committed, log._read_end) and s.count > 1
+            ]
+            if len(candidates) == 0:
+                return False
+            segment = min(candidates, key=lambda s: (s.level, s.base_offset))
+            counters = {}
+
+            def _keep(item):
+                n = counters.get(item.get("collector_id"), 0)
+                counters[item.get("collector_id")] = n + 1
+                return n % 2 == 0
+
+            segment.level += 1
+            removed = log.rewrite(segment, keep=_keep)
+            self.evicted.downsampled += removed
+            return removed > 0
+
+    def enforce_limits(self):
+        """
+        Evicts items from the backlog when the backlog exceeds its limits.
+        """
+        log = self.segment_log
+        with log.lock:
+            evicted = sum(self.evicted.values())
+            if self.max_age is not None:
+                while (
+                    len(log.segments) > 0
+                    and log.segments[0].last_time < time.time() - self.max_age
+                ):
+                    self.evicted.expired += log.drop_segment()
+            if self.eviction != "drop_newest":
+                while self.over_limit():
+                    if self.eviction == "downsample" and self.downsample():
+                        continue
+                    if self.max_items is not None and self.size() > self.max_items:
+                        self.evicted.oldest += log.drop(self.size() - self.max_items)
+                    elif len(log.segments) > 1:
+                        self.evicted.oldest += log.drop_segment()
+                    else:
+                        break
+            if sum(self.evicted.values()) > evicted:
+                self.log.warning(
+                    "The backlog exceeded its limits, %d items were evicted (policy=%s). The number of evicted items is %s."
+                    % (
+                        sum(self.evicted.values()) - evicted,
+                        self.eviction,
+                        str(dict(self.evicted)),
+                    )
+                )
+
+    def peek(self, size):
+        """
+        Returns at most `size` items from the backlog together with the offset that must be passed
+        to `remove` to remove the items from the backlog.
+        """
+        return self.segment_log.read(size)
+
+    def remove(self, offset):
+        if self.writer.args.test:
+            self.log.info(
+                "Running in test mode, removing of backlog items is disabled."
+            )
+        self.segment_log.commit(offset, persist=not self.writer.args.test)
+        self.log.debug(
+            "Removing data from the writer's backlog. The backlog size is %s."
+            % (self.size())
+        )
+
+    def size(self):
+        return self.segment_log.size()
+
+    def sync(self):
+        self.segment_log.sync()
+        if not self.writer.args.test:
+            self.enforce_limits()
+
+    def close(self):
+        self.segment_log.close()
+
+    def process(self):
+        if self.size() > 0:
+            self.log.info(
+                "There are %d items in the backlog. Writing items in batches of %d..."
+                % (self.size(), self.writer.batch_size)
+            )
+            while self.size() > 0:
+                offset, batch = self.peek(self.writer.batch_size)
+                try:
+                    if not self.writer.args.test:
+                        self.writer.do_write(batch)
+                    else:
+                        self.log.info(
+                            "Running in test mode, writing of backlog items is disabled (the backlog will be removed from memory only)."
+                        )
+                    self.remove(offset)
+                except Exception as e:
+                    self.log.error(
+                        "Cannot write item from the writer's backlog due to: %s"
+                        % (str(e)),
+                        exc_info=self.writer.args.debug or self.writer.args.trace,
+                    )
+                    self.writer._is_healthy = False
+                    break
+            self.log.info(
+                "The processing of the backlog finished. The backlog size is %s."
+                % self.size()
+            )
@@ -7,36 +7,504 @@ from __future__ import unicode_literals
 import time
 import logging
 import os
+import io
+import csv
+import glob
+import queue
+import threading
+import json
+import gzip
+import shutil
+
+from collections import OrderedDict
+from datetime import datetime
 
-from influxdb import InfluxDBClient
 from .writer import Writer, HealthCheckException
-from yamc.utils import import_class, randomString
+from .backlog import FSYNC_POLICIES
+
+# rotation intervals of the TimedRotatingFileHandler in seconds
+HANDLER_WHEN = {"S": 1, "M": 60, "H": 3600, "D": 86400, "MIDNIGHT": 86400}
+
+
+class FileTasks:
+    """
+    Runs file operations such as renaming of rotated files in a background thread. The tasks
+    run in the order they were submitted.
+    """
+
+    def __init__(self, log=None):
+        self.log = log if log is not None else logging.getLogger(__name__)
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.queue.put((fn, args))
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    break
+                task[0](*task[1])
+            except Exception as e:
+                self.log.error("The file task failed: %s" % str(e))
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        """
+        Waits for all submitted tasks and stops the thread.
+        """
+        with self.lock:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+                self.thread = None
+
+
+class CsvFile:
+    """
+    CSV file with a stable order of columns. Rows of a batch are formatted to a single block that
+    is written to a buffered file. The file is rotated when it exceeds `max_bytes` or when it is
+    older than `rotate_interval` seconds; the rotated file is renamed to a temporary name and
+    the backups are shifted by the `tasks` in the background. The time when the file was started
+    is not known from the file system, it is given by `open_time` for an existing file and
+    `opened` is called with the file, its open time and whether it has the header when a new file
+    is started. The columns of an existing file are read from its header only when `has_header`
+    is set, i.e. the file was started with the header.
+    """
+
+    def __init__(
+        self,
+        filename,
+        columns=None,
+        header=True,
+        max_bytes=0,
+        rotate_interval=0,
+        backup_count=5,
+        buffer_size=64 * 1024,
+        flush=True,
+        fsync="never",
+        fsync_interval=1,
+        tasks=None,
+        open_time=None,
+        has_header=False,
+        opened=None,
+        log=None,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise Exception(
+                "Invalid fsync policy '%s', the policy must be one of %s!"
+                % (fsync, ", ".join(FSYNC_POLICIES))
+            )
+        self.filename = filename
+        self.columns = list(columns) if columns is not None else None
+        self.header = header
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush = flush
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.tasks = tasks if tasks is not None else FileTasks(log)
+        self.open_time = open_time
+        self.has_header = has_header
+        self.opened = opened
+        self.log = log if log is not None else logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self._file = None
+        self._size = 0
+        self._last_fsync = 0
+        self._ignored = set()
 
-# we need a new manager not to mess up with yamc logging configuration
-manager = logging.Manager(logging.RootLogger(logging.INFO))
+        # rotated files that were not renamed before the last shutdown
+        for rotated in sorted(
+            glob.glob(glob.escape(filename) + ".*.rotating"),
+            key=lambda x: int(x.split(".")[-2]),
+        ):
+            self.tasks.submit(self.shift, rotated)
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        self._file = open(self.filename, "ab", buffering=self.buffer_size)
+        self._size = self._file.tell()
+        if self._size == 0 or self.open_time is None:
+            self.open_time = time.time()
+            if self._size == 0:
+                self.has_header = self.header
+            if self.opened is not None:
+                self.opened(self.filename, self.open_time, self.has_header)
+        if self._size > 0 and self.has_header and self.columns is None:
+            # columns of an existing file are taken from its header
+            with open(self.filename, "r", newline="") as f:
+                self.columns = next(csv.reader(f), None)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def rotate(self):
+        """
+        Closes the file and renames it to a temporary name, the backups are shifted in the background.
+        """
+        self._close()
+        if os.path.exists(self.filename):
+            rotated = "%s.%d.rotating" % (self.filename, time.time_ns())
+            os.rename(self.filename, rotated)
+            self.tasks.submit(self.shift, rotated)
+
+    def shift(self, rotated):
+        """
+        Shifts the backups of the file and renames the `rotated` file to the first backup.
+        """
+        if self.backup_count <= 0:
+            os.remove(rotated)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            backup = "%s.%d" % (self.filename, i)
+            if os.path.exists(backup):
+                os.replace(backup, "%s.%d" % (self.filename, i + 1))
+        os.replace(rotated, self.filename + ".1")
+
+    def format(self, rows):
+        """
+        Formats the rows given as dicts to a CSV block in the order of columns.
+        """
+        if self.columns is None:
+            self.columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if self._size == 0 and self.header:
+            writer.writerow(self.columns)
+        columns, columns_set = self.columns, set(self.columns)
+        for row in rows:
+            if not columns_set.issuperset(row.keys()):
+                for k in row.keys():
+                    if k not in columns_set and k not in self._ignored:
+                        self._ignored.add(k)
+                        self.log.warning(
+                            "The field '%s' is not in the columns of %s, it will be ignored."
+                            % (k, self.filename)
+                        )
+            writer.writerow([row.get(k) for k in columns])
+        return buffer.getvalue().encode("utf-8")
+
+    def write(self, rows):
+        """
+        Writes the rows as a single block, the file is rotated before the block when necessary.
+        """
+        if len(rows) == 0:
+            return
+        with self.lock:
+            if self._file is None:
+                self.open()
+            if self._size > 0 and (
+                (self.max_bytes > 0 and self._size >= self.max_bytes)
+                or (
+                    self.rotate_interval > 0
+                    and time.time() - self.open_time >= self.rotate_interval
+                )
+            ):
+                self.rotate()
+                self.open()
+            block = self.format(rows)
+            self._file.write(block)
+            self._size += len(block)
+            if self.flush or self.fsync != "never":
+                self._file.flush()
+            if self.fsync == "always" or (
+                self.fsync == "interval"
+                and time.time() - self._last_fsync >= self.fsync_interval
+            ):
+                os.fsync(self._file.fileno())
+                self._last_fsync = time.time()
+
+
+class PartitionIndex:
+    """
+    Sidecar index of partitions with the time range and the number of rows of each partition
+    so that readers can skip partitions. Partitions are stored relative to the index directory;
+    the `compressed` flag indicates that the rows of the partition are in the `.gz` file and
+    `opened` is the time when the partition's current file was started and `header` indicates
+    that the file was started with the header.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dir = os.path.dirname(filename)
+        self.lock = threading.Lock()
+        self.partitions = {}
+        if os.path.exists(filename):
+            with open(filename, "r") as f:
+                self.partitions = json.load(f)
+
+    def get(self, path):
+        return self.partitions.get(os.path.relpath(path, self.dir))
+
+    def update(
+        self,
+        path,
+        min_time=None,
+        max_time=None,
+        rows=0,
+        compressed=None,
+        opened=None,
+        header=None,
+    ):
+        with self.lock:
+            p = self.partitions.setdefault(
+                os.path.relpath(path, self.dir),
+                {"min_time": min_time, "max_time": max_time, "rows": 0},
+            )
+            if min_time is not None:
+                p["min_time"] = min(p["min_time"] or min_time, min_time)
+                p["max_time"] = max(p["max_time"] or max_time, max_time)
+            p["rows"] += rows
+            if compressed is not None:
+                p["compressed"] = compressed
+            if opened is not None:
+                p["opened"] = opened
+            if header is not None:
+                p["header"] = header
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.dir, exist_ok=True)
+            tmp = self.filename + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.partitions, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.filename)
 
 
 class CsvWriter(Writer):
+    """
+    Writer of the fields of writer's items to a CSV file. The `handler` configuration of the
+    previous versions with the properties of a rotating logging handler is supported.
+
+    When the `path` template is set, the items are written to partitions such as
+    `{collector_id}/{time:%Y-%m-%d}.csv`, where `time` is the time of the item. Partitions that
+    were not written for `close_after` seconds are closed and compressed in the background,
+    the partitions are recorded in the `index.json` file in the partitions' base directory.
+    Without the `path` template, the open time of the file is recorded in the `.index.json` file
+    next to the file so that the rotation interval continues after a restart.
+    """
+
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
-        self.handler_def = self.config.value("handler")
-        clazz = import_class(self.handler_def["class"])
-        self.csv_writer = manager.getLogger(f"CsvWriter_{randomString()}")
-        self.csv_writer.setLevel(logging.INFO)
-        if "filename" in self.handler_def:
-            self.handler_def["filename"] = self.config.get_dir_path(
-                self.handler_def["filename"], check=False
-            )
-            os.makedirs(os.path.dirname(self.handler_def["filename"]), exist_ok=True)
-        self.csv_writer.addHandler(
-            clazz(**{k: v for k, v in self.handler_def.items() if k != "class"})
+        handler = self.config.value("handler", default={}, required=False)
+        when = str(handler.get("when", "")).upper()
+        self.tasks = FileTasks(self.log)
+        self.file_options = dict(
+            columns=self.config.value("columns", default=None),
+            # the files of the logging handler had no header
+            header=self.config.value_bool("header", default=len(handler) == 0),
+            max_bytes=self.config.value_int(
+                "max_bytes", default=handler.get("maxBytes", 0)
+            ),
+            rotate_interval=self.config.value_int(
+                "rotate_interval",
+                default=HANDLER_WHEN.get(when, 0) * handler.get("interval", 1),
+            ),
+            backup_count=self.config.value_int(
+                "backup_count", default=handler.get("backupCount", 5)
+            ),
+            buffer_size=self.config.value_int("buffer_size", default=64 * 1024),
+            flush=self.config.value_bool("flush", default=True),
+            fsync=self.config.value_str("fsync", default="never"),
+            fsync_interval=self.config.value("fsync_interval", default=1),
+            tasks=self.tasks,
+            log=self.log,
         )
 
+        path = self.config.value_str("path", default=None)
+        if path is not None:
+            self.path = self.config.get_dir_path(path, check=False)
+            self.filename = None
+            self.close_after = self.config.value_int("close_after", default=300)
+            self.max_open = self.config.value_int("max_open", default=64, min=1)
+            self.compress = self.config.value_bool("compress", default=True)
+            # open partitions, the least recently written first
+            self.partitions = OrderedDict()
+            self.partitions_lock = threading.Lock()
+            self.index = PartitionIndex(
+                os.path.join(os.path.dirname(self.path.split("{")[0]), "index.json")
+            )
+            self.compress_closed()
+        else:
+            filename = self.config.value_str(
+                "filename", default=handler.get("filename")
+            )
+            if filename is None:
+                raise Exception("The property filename or path is required!")
+            self.path = None
+            self.filename = self.config.get_dir_path(filename, check=False)
+            self.index = PartitionIndex(self.filename + ".index.json")
+            self.csv_file = CsvFile(
+                self.filename,
+                open_time=self.open_time(self.filename),
+                has_header=self.has_header(self.filename),
+                opened=self.file_opened,
+                **self.file_options,
+            )
+
     def healthcheck(self):
         pass
 
-    def do_write(self, items):
-        self.log.debug(f"Writing {len(items)} rows to {self.handler_def['filename']}")
+    def destroy(self):
+        super().destroy()
+        if self.path is not None:
+            with self.partitions_lock:
+                for path, (csv_file, t) in self.partitions.items():
+                    csv_file.close()
+                self.partitions.clear()
+        else:
+            self.csv_file.close()
+        self.index.save()
+        self.tasks.close()
+
+    def open_time(self, path):
+        """
+        Returns the recorded time when the file was started or None.
+        """
+        entry = self.index.get(path)
+        return entry.get("opened") if entry is not None else None
+
+    def has_header(self, path):
+        """
+        Returns True when the file was started with the header by the writer.
+        """
+        entry = self.index.get(path)
+        return entry is not None and entry.get("header", False)
+
+    def file_opened(self, path, open_time, has_header):
+        self.index.update(path, opened=open_time, header=has_header)
+        self.tasks.submit(self.index.save)
+
+    def partition(self, path):
+        """
+        Returns the open partition for the path.
+        """
+        p = self.partitions.pop(path, None)
+        if p is None:
+            options = dict(self.file_options)
+            # the partition that was written before has the header already
+            entry = self.index.get(path)
+            options["header"] = options["header"] and (
+                entry is None or entry["rows"] == 0
+            )
+            p = (
+                CsvFile(
+                    path,
+                    open_time=self.open_time(path),
+                    has_header=self.has_header(path),
+                    opened=self.file_opened,
+                    **options,
+                ),
+                0,
+            )
+        self.partitions[path] = (p[0], time.time())
+        return p[0]
+
+    def close_partitions(self):
+        """
+        Closes partitions that were not written for `close_after` seconds and the least recently
+        written partitions over `max_open`.
+        """
+        closed = []
+        while len(self.partitions) > 0:
+            path, (csv_file, t) = next(iter(self.partitions.items()))
+            if (
+                time.time() - t < self.close_after
+                and len(self.partitions) <= self.max_open
+            ):
+                break
+            del self.partitions[path]
+            csv_file.close()
+            closed.append(path)
+        for path in closed:
+            self.log.debug("Closing the partition %s." % path)
+            if self.compress and os.path.exists(path):
+                closing = "%s.%d.closing" % (path, time.time_ns())
+                os.rename(path, closing)
+                self.tasks.submit(self.compress_partition, closing, path)
+        if len(closed) > 0:
+            self.tasks.submit(self.index.save)
+
+    def compress_partition(self, closing, path):
+        """
+        Appends the closed partition to the partition's `.gz` file.
+        """
+        with open(closing, "rb") as src, gzip.open(path + ".gz", "ab") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(closing)
+        self.index.update(path, compressed=True)
+        self.index.save()
+
+    def compress_closed(self):
+        """
+        Compresses partitions that were closed before the last shutdown.
+        """
+        if not self.compress:
+            return
+        for closing in glob.glob(
+            os.path.join(glob.escape(self.index.dir), "**", "*.closing"),
+            recursive=True,
+        ):
+            self.tasks.submit(
+                self.compress_partition, closing, closing.rsplit(".", 2)[0]
+            )
+        for rel_path, entry in self.index.partitions.items():
+            path = os.path.join(self.index.dir, rel_path)
+            if (
+                os.path.exists(path)
+                and time.time() - os.path.getmtime(path) >= self.close_after
+            ):
+                closing = "%s.%d.closing" % (path, time.time_ns())
+                os.rename(path, closing)
+                self.tasks.submit(self.compress_partition, closing, path)
+
+    def write_partitions(self, items):
+        groups = {}
         for data in items:
-            line = [str(v) for k, v in data.writer_config.fields.items()]
-            self.csv_writer.info(",".join(line))
+            t = data.data.get("time") or time.time()
+            path = self.path.format(
+                collector_id=data.collector_id, time=datetime.fromtimestamp(t)
+            )
+            group = groups.get(path)
+            if group is None:
+                group = groups[path] = ([], [])
+            group[0].append(t)
+            group[1].append(data.writer_config.fields)
+        with self.partitions_lock:
+            for path, (times, rows) in groups.items():
+                self.partition(path).write(rows)
+                self.index.update(path, min(times), max(times), len(rows))
+            self.close_partitions()
+
+    def do_write(self, items):
+        try:
+            if self.path is not None:
+                self.log.debug(
+                    f"Writing {len(items)} rows to partitions of {self.path}"
+                )
+                self.write_partitions(items)
+            else:
+                self.log.debug(f"Writing {len(items)} rows to {self.filename}")
+                self.csv_file.write([data.writer_config.fields for data in items])
+        except OSError as e:
+            raise HealthCheckException("Writing to the CSV file failed!", e)
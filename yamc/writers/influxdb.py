@@ -4,13 +4,160 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+import os
+import re
+import json
 import time
+import numbers
 import logging
+import threading
 
 from influxdb import InfluxDBClient
+from influxdb.exceptions import InfluxDBClientError
 from .writer import Writer, HealthCheckException
 
-from yamc.utils import Map, is_number
+from yamc.utils import Record, is_number
+
+try:
+    from numpy import bool_ as numpy_bool
+except ImportError:
+    numpy_bool = bool
+
+# the number of time units in one second for each timestamp precision
+TIME_PRECISIONS = {
+    "n": 10**9,
+    "u": 10**6,
+    "ms": 10**3,
+    "s": 1,
+    "m": 1 / 60,
+    "h": 1 / 3600,
+}
+
+MEASUREMENT_ESCAPE = str.maketrans({",": "\\,", " ": "\\ ", "\n": "\\n"})
+KEY_ESCAPE = str.maketrans({",": "\\,", "=": "\\=", " ": "\\ ", "\n": "\\n"})
+STRING_ESCAPE = str.maketrans({'"': '\\"', "\\": "\\\\", "\n": "\\n"})
+
+# errors of InfluxDB that name the rejected line or the rejected field
+UNABLE_TO_PARSE = re.compile(r"unable to parse '(.*)': ")
+FIELD_CONFLICT = re.compile(r'input field "(.+?)" on measurement "(.+?)"')
+# the separator after the measurement in a line
+SERIES_SEPARATOR = re.compile(r"(?<!\\)[ ,]")
+
+
+class LineEncoder:
+    """
+    Encodes points to the InfluxDB line protocol. Escaped measurements, keys and series are
+    cached so that they are escaped only once; lines are sorted by series.
+    """
+
+    # the maximum number of cached series
+    MAX_SERIES = 10000
+
+    def __init__(self, time_precision="s"):
+        self.time_factor = TIME_PRECISIONS[time_precision]
+        self.measurements = {}
+        self.keys = {}
+        self._series = {}
+
+    def measurement(self, name):
+        m = self.measurements.get(name)
+        if m is None:
+            m = self.measurements[name] = str(name).translate(MEASUREMENT_ESCAPE)
+        return m
+
+    def key(self, name):
+        k = self.keys.get(name)
+        if k is None:
+            k = self.keys[name] = str(name).translate(KEY_ESCAPE)
+        return k
+
+    def series(self, measurement, tags):
+        """
+        Returns the series key of the point, tags are sorted by their keys.
+        """
+        try:
+            cache_key = (measurement, tuple(tags.items()))
+            series = self._series.get(cache_key)
+        except TypeError:
+            # unhashable tag values are not cached
+            cache_key, series = None, None
+        if series is None:
+            series = self.measurement(measurement)
+            for k in sorted(tags.keys()):
+                v = tags[k]
+                if v is not None and v != "":
+                    series += "," + self.key(k) + "=" + str(v).translate(KEY_ESCAPE)
+            if cache_key is not None:
+                if len(self._series) >= self.MAX_SERIES:
+                    self._series.clear()
+                self._series[cache_key] = series
+        return series
+
+    def field(self, value):
+        # numbers of other types such as NumPy scalars are encoded as Python numbers
+        if isinstance(value, (bool, numpy_bool)):
+            return "true" if value else "false"
+        if isinstance(value, numbers.Integral):
+            return "%di" % int(value)
+        if isinstance(value, numbers.Real):
+            return repr(float(value))
+        return '"' + str(value).translate(STRING_ESCAPE) + '"'
+
+    def fields(self, fields):
+        return ",".join(
+            [
+                self.key(k) + "=" + self.field(v)
+                for k, v in fields.items()
+                if v is not None
+            ]
+        )
+
+    def timestamp(self, t):
+        """
+        Returns the timestamp of the time in seconds, the time can be a number or a string.
+        """
+        return int(float(t) * self.time_factor)
+
+    def encode(self, points):
+        """
+        Encodes the points given as tuples (measurement, tags, fields, time) to the lines.
+        Points without fields are skipped.
+        """
+        lines = []
+        for measurement, tags, fields, t in points:
+            _fields = self.fields(fields)
+            if _fields != "":
+                lines.append(
+                    (self.series(measurement, tags), _fields, self.timestamp(t))
+                )
+        # the sort is stable, the order of points in a series is kept
+        lines.sort(key=lambda x: x[0])
+        return ["%s %s %d" % line for line in lines]
+
+
+def is_rejected(e):
+    """
+    Returns True when InfluxDB rejected the points, such as due to a field type conflict.
+    """
+    return isinstance(e, InfluxDBClientError) and e.code == 400
+
+
+def is_permanent(e):
+    """
+    Returns True when the write cannot succeed when retried, such as due to invalid credentials
+    or a missing database.
+    """
+    return isinstance(e, InfluxDBClientError) and e.code in (401, 403, 404)
+
+
+def error_message(e):
+    """
+    Returns the error message of InfluxDB from the response content of the error.
+    """
+    try:
+        return json.loads(e.content)["error"]
+    except Exception:
+        return str(e.content)
 
 
 class InfluxDBWriter(Writer):
@@ -21,21 +168,57 @@ class InfluxDBWriter(Writer):
         self.user = self.config.value_str("user", default="")
         self.pswd = self.config.value_str("user", default="")
         self.dbname = self.config.value_str("dbname")
+        self.protocol = self.config.value_str("protocol", default="line")
+        if self.protocol not in ["line", "json"]:
+            raise Exception(
+                "Invalid protocol %s, the valid values are line or json!"
+                % self.protocol
+            )
+        self.time_precision = self.config.value_str("time_precision", default="s")
+        if self.time_precision not in TIME_PRECISIONS:
+            raise Exception(
+                "Invalid time precision %s, the valid values are %s!"
+                % (self.time_precision, ", ".join(TIME_PRECISIONS.keys()))
+            )
+        self.gzip = self.config.value_bool("gzip", default=True)
+        self.encoder = LineEncoder(self.time_precision)
+
+        # points rejected by InfluxDB are stored in the quarantine file when enabled
+        self.quarantine_file = None
+        if self.config.value_bool("quarantine", default=True):
+            quarantine_dir = config.get_dir_path(config.data_dir + "/quarantine")
+            os.makedirs(quarantine_dir, exist_ok=True)
+            self.quarantine_file = os.path.join(
+                quarantine_dir, "%s.lp" % self.component_id
+            )
+        self.quarantine_lock = threading.Lock()
         self.log.info(
-            "Creating client connection, host=%s, port=%s, user=%s, password=(secret), dbname=%s"
-            % (self.host, self.port, self.user, self.dbname)
+            "Creating client connection, host=%s, port=%s, user=%s, password=(secret), dbname=%s, protocol=%s, gzip=%s"
+            % (self.host, self.port, self.user, self.dbname, self.protocol, self.gzip)
         )
+        # failed writes are retried by the writer, the client makes a single attempt
         self.client = InfluxDBClient(
-            self.host, self.port, self.user, self.pswd, self.dbname
+            self.host,
+            self.port,
+            self.user,
+            self.pswd,
+            self.dbname,
+            gzip=self.gzip,
+            retries=1,
         )
 
     def healthcheck(self):
         self.client.ping()
 
     def _create_fields_tags(self, data):
+        scope = None
+
         def _value(v):
+            nonlocal scope
             if callable(getattr(v, "eval", None)):
-                return v.eval(self.base_scope(Map(data=Map(data.data))))
+                if scope is None:
+                    scope = self.base_scope({"data": data.data})
+                return v.eval(scope)
             else:
                 return v
 
@@ -53,28 +236,164 @@ class InfluxDBWriter(Writer):
                         tags[k] = v
         return fields, tags
 
-    def do_write(self, items):
+    def create_points(self, items):
+        """
+        Creates the points as tuples (measurement, tags, fields, time) from the writer's items.
+        """
         points = []
         for data in items:
             fields, tags = self._create_fields_tags(data)
-            point = Map(
-                measurement=data.writer_config.get("measurement", data.collector_id),
-                time=int(data.data.get("time", 0)) * 1000000000,
-                fields=fields,
-                tags=tags,
+            point = (
+                data.writer_config.get("measurement", data.collector_id),
+                tags,
+                fields,
+                data.data.get("time", 0),
             )
-            if point.time == 0:
-                log.error(
+            if not point[3]:
+                self.log.error(
                     "Cannot write the data point %s to the influxdb due to a missing time field!"
                     % str(point)
                 )
                 continue
-            if len(point.fields.keys()) == 0:
-                log.warn("There are no fields in the data point %s!" % str(point))
+            if len(fields.keys()) == 0:
+                self.log.warning(
+                    "There are no fields in the data point %s!" % str(point)
+                )
             points.append(point)
+        return points
+
+    def do_write(self, items):
+        points = self.create_points(items)
+        if self.protocol == "line":
+            data = self.encoder.encode(points)
+        else:
+            data = [
+                Record(
+                    measurement=m,
+                    tags=tags,
+                    fields=fields,
+                    time=self.encoder.timestamp(t),
+                )
+                for m, tags, fields, t in points
+            ]
+        if self.log.isEnabledFor(logging.DEBUG - 5):
+            self.log.trace("Writing data points: " + str(data))
+        try:
+            rejected = self.write_points(data)
+        except Exception as e:
+            if not is_permanent(e):
+                raise HealthCheckException("Writing the points to influxdb failed!", e)
+            self.quarantine(data, e)
+            raise Exception(
+                "Writing the points to influxdb failed permanently, the points were %s! %s"
+                % (self.quarantined(), str(e))
+            )
+        if rejected > 0:
+            self.log.error(
+                "InfluxDB rejected %d of %d points, the points were %s."
+                % (rejected, len(data), self.quarantined())
+            )
+
+    def quarantined(self):
+        return (
+            "quarantined in " + self.quarantine_file
+            if self.quarantine_file is not None
+            else "discarded"
+        )
 
-        self.log.trace("Writing data points: " + str(points))
+    def write_points(self, data):
+        """
+        Writes the points and returns the number of points rejected by InfluxDB. When the error
+        names the rejected line or field, the named points are isolated by bisection and the other
+        points are written again which is safe as InfluxDB overwrites points with the same series
+        and time. When the error does not name any points, the whole batch is rejected.
+        """
         try:
-            self.client.write_points(points)
+            self._write_points(data)
+            return 0
         except Exception as e:
-            raise HealthCheckException("Writing the points to influxdb failed!", e)
+            if not is_rejected(e):
+                raise
+            message = error_message(e)
+            named = self.named_points(data, message)
+            if named is None or len(data) == 1:
+                self.quarantine(data, e)
+                return len(data)
+            rejected = 0
+            if len(named) < len(data):
+                named_ids = set([id(x) for x in named])
+                rest = [x for x in data if id(x) not in named_ids]
+                # points of a partial write that were not dropped were written
+                if not message.startswith("partial write"):
+                    rejected += self.write_points(rest)
+                if len(named) == 1:
+                    self.quarantine(named, e)
+                    return rejected + 1
+                return rejected + self.write_points(named)
+            self.log.debug(
+                "InfluxDB rejected the batch of %d points, bisecting the batch: %s"
+                % (len(data), message)
+            )
+            middle = len(data) // 2
+            return self.write_points(data[:middle]) + self.write_points(data[middle:])
+
+    def named_points(self, data, message):
+        """
+        Returns the points named by the error message, all points when the named points cannot
+        be found or None when the message does not name any points.
+        """
+        m = UNABLE_TO_PARSE.search(message)
+        if m is not None:
+            named = [x for x in data if x == m.group(1)]
+        else:
+            m = FIELD_CONFLICT.search(message)
+            if m is None:
+                return data if "dropped=" in message else None
+            field, measurement = m.group(1), m.group(2)
+            if self.protocol == "line":
+                key = self.encoder.key(field) + "="
+                prefix = self.encoder.measurement(measurement)
+                named = [
+                    x
+                    for x in data
+                    if SERIES_SEPARATOR.split(x, 1)[0] == prefix
+                    and (" " + key in x or "," + key in x)
+                ]
+            else:
+                named = [
+                    x
+                    for x in data
+                    if x.measurement == measurement and field in x.fields
+                ]
+        return named if len(named) > 0 else data
+
+    def _write_points(self, data):
+        self.client.write_points(
+            data, time_precision=self.time_precision, protocol=self.protocol
+        )
+
+    def quarantine(self, data, e):
+        """
+        Stores the rejected points in the line protocol in the quarantine file with the error
+        as a comment.
+        """
+        self.log.debug("The point was rejected: %s, error: %s" % (str(data[0]), str(e)))
+        if self.quarantine_file is None:
+            return
+        with self.quarantine_lock:
+            with open(self.quarantine_file, "a") as f:
+                f.write("# %s\n" % " ".join(str(e).splitlines()))
+                for point in data:
+                    f.write("%s\n" % self.line(point))
+
+    def line(self, point):
+        """
+        Returns the point in the line protocol, points of the json protocol are encoded.
+        """
+        if isinstance(point, str):
+            return point
+        return "%s %s %d" % (
+            self.encoder.series(point.measurement, point.tags),
+            self.encoder.fields(point.fields),
+            point.time,
+        )
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# @author: Tomas Vitvar, https://vitvar.com, tomas.vitvar@oracle.com
+
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+
+from .writer import Writer, HealthCheckException
+
+# SQLite column types of Python values
+COLUMN_TYPES = {bool: "INTEGER", int: "INTEGER", float: "REAL", str: "TEXT"}
+
+# the table of the tables created by the writers, it cannot collide with the collectors' tables
+TABLES_TABLE = "yamc.tables"
+
+
+def quote(name):
+    return '"%s"' % str(name).replace('"', '""')
+
+
+def sqlite_value(v):
+    """
+    Converts the value to a type supported by SQLite. NumPy values are converted to Python
+    values, dicts and lists to JSON, ints out of the SQLite range and values of other types
+    to strings.
+    """
+    if callable(getattr(v, "tolist", None)):
+        v = v.tolist()
+    if v is None or isinstance(v, (bool, float, str, bytes)):
+        return v
+    if isinstance(v, int):
+        return v if -(2**63) <= v < 2**63 else str(v)
+    if isinstance(v, (dict, list, tuple)):
+        return json.dumps(
+            v,
+            default=lambda x: x.tolist()
+            if callable(getattr(x, "tolist", None))
+            else str(x),
+        )
+    return str(v)
+
+
+class SqliteWriter(Writer):
+    """
+    Writer of the fields of writer's items to a SQLite database in the WAL mode. Items of each
+    collector are inserted in batches to the collector's table that is created from the fields
+    of the first item; the `time` column holds the time of the item and is indexed. The tables
+    created by the writer are recorded in the database and only these tables are pruned of rows
+    older than `retention` seconds in the background.
+    """
+
+    def __init__(self, config, component_id):
+        super().__init__(config, component_id)
+        self.filename = self.config.get_dir_path(
+            self.config.value_str(
+                "filename", default=config.data_dir + "/" + component_id + ".db"
+            ),
+            check=False,
+        )
+        self.synchronous = self.config.value_str("synchronous", default="NORMAL")
+        self.busy_timeout = self.config.value_int("busy_timeout", default=5000)
+        self.retention = self.config.value("retention", default=None)
+        self.prune_interval = self.config.value_int("prune_interval", default=60)
+        self.prune_chunk = self.config.value_int("prune_chunk", default=10000, min=1)
+        self.lock = threading.Lock()
+        self.conn = self.connect()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, writer_id TEXT)"
+            % quote(TABLES_TABLE)
+        )
+        # columns of the collectors' tables created by the writer
+        self.tables = {}
+        for (name,) in self.conn.execute(
+            "SELECT name FROM %s WHERE writer_id = ?" % quote(TABLES_TABLE),
+            (self.component_id,),
+        ).fetchall():
+            columns = self.table_columns(name)
+            if columns is not None:
+                self.tables[name] = columns
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        conn = sqlite3.connect(
+            self.filename, check_same_thread=False, isolation_level=None
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=%s" % self.synchronous)
+        conn.execute("PRAGMA busy_timeout=%d" % self.busy_timeout)
+        return conn
+
+    def healthcheck(self):
+        with self.lock:
+            self.conn.execute("SELECT 1").fetchone()
+
+    def destroy(self):
+        super().destroy()
+        with self.lock:
+            self.conn.close()
+
+    def table_columns(self, table):
+        """
+        Returns the columns of the table in the database or None when the table does not exist.
+        """
+        columns = [
+            r[1] for r in self.conn.execute("PRAGMA table_info(%s)" % quote(table))
+        ]
+        return columns if len(columns) > 0 else None
+
+    def table_name(self, collector_id):
+        """
+        Returns the table name of the collector. Names with characters other than letters, digits
+        and underscores are replaced and suffixed with a hash of the collector id so that
+        the names of different collectors do not collide.
+        """
+        name = re.sub(r"\W", "_", collector_id)
+        if name != collector_id:
+            name += "_" + hashlib.sha1(collector_id.encode("utf-8")).hexdigest()[:8]
+        return name
+
+    def create_table(self, table, row):
+        """
+        Creates the table with columns of the row or adds the row's columns that do not exist.
+        """
+        columns = self.tables.get(table)
+        if columns is None:
+            if self.table_columns(table) is not None:
+                raise Exception(
+                    "The table %s exists but it was not created by the writer!" % table
+                )
+            self.conn.execute(
+                "CREATE TABLE %s (%s)"
+                % (
+                    quote(table),
+                    ", ".join(
+                        [
+                            "%s %s" % (quote(k), COLUMN_TYPES.get(type(v), ""))
+                            for k, v in row.items()
+                        ]
+                    ),
+                )
+            )
+            self.conn.execute(
+                "CREATE INDEX %s ON %s (time)" % (quote(table + ".time"), quote(table))
+            )
+            self.conn.execute(
+                "INSERT INTO %s (name, writer_id) VALUES (?, ?)" % quote(TABLES_TABLE),
+                (table, self.component_id),
+            )
+            columns = self.tables[table] = list(row.keys())
+        else:
+            for k, v in row.items():
+                if k not in columns:
+                    self.conn.execute(
+                        "ALTER TABLE %s ADD COLUMN %s %s"
+                        % (quote(table), quote(k), COLUMN_TYPES.get(type(v), ""))
+                    )
+                    columns.append(k)
+        return columns
+
+    def create_row(self, data):
+        row = {"time": sqlite_value(data.data.get("time", time.time()))}
+        for k, v in data.writer_config.fields.items():
+            row[k] = sqlite_value(v)
+        return row
+
+    def do_write(self, items):
+        groups = {}
+        for data in items:
+            groups.setdefault(self.table_name(data.collector_id), []).append(
+                self.create_row(data)
+            )
+        with self.lock:
+            try:
+                self.conn.execute("BEGIN")
+                for table, rows in groups.items():
+                    columns = self.create_table(table, rows[0])
+                    columns_set = set(columns)
+                    for row in rows:
+                        if not columns_set.issuperset(row.keys()):
+                            columns = self.create_table(table, row)
+                            columns_set = set(columns)
+                    self.conn.executemany(
+                        "INSERT INTO %s (%s) VALUES (%s)"
+                        % (
+                            quote(table),
+                            ", ".join([quote(k) for k in columns]),
+                            ", ".join(["?"] * len(columns)),
+                        ),
+                        [[row.get(k) for k in columns] for row in rows],
+                    )
+                self.conn.execute("COMMIT")
+            except Exception as e:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                # changes of the tables are rolled back with the transaction
+                for table in [t for t in groups.keys() if t in self.tables]:
+                    columns = self.table_columns(table)
+                    if columns is not None:
+                        self.tables[table] = columns
+                    else:
+                        self.tables.pop(table, None)
+                if isinstance(e, sqlite3.OperationalError):
+                    raise HealthCheckException(
+                        "Writing to the SQLite database failed!", e
+                    )
+                raise
+
+    def prune(self):
+        """
+        Deletes the rows older than `retention` seconds from the writer's tables in chunks of
+        `prune_chunk` rows so that the writes are not blocked for a long time.
+        """
+        conn = self.connect()
+        try:
+            deleted = 0
+            for table in list(self.tables.keys()):
+                while True:
+                    c = conn.execute(
+                        "DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s WHERE time < ? LIMIT ?)"
+                        % (quote(table), quote(table)),
+                        (time.time() - self.retention, self.prune_chunk),
+                    )
+                    deleted += c.rowcount
+                    if c.rowcount < self.prune_chunk:
+                        break
+            if deleted > 0:
+                self.log.info("Pruned %d rows older than the retention." % deleted)
+        finally:
+            conn.close()
+
+    def pruner(self, exit_event):
+        while not exit_event.wait(self.prune_interval):
+            try:
+                self.prune()
+            except Exception as e:
+                self.log.error("Pruning of the database failed: %s" % str(e))
+
+    def worker(self, exit_event):
+        if self.retention is not None and not self.args.test:
+            threading.Thread(
+                target=self.pruner, args=(exit_event,), daemon=True
+            ).start()
+        super().worker(exit_event)
@@ -4,24 +4,151 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-import os
 import sys
 import time
 import threading
 import logging
-import re
 import ast
-import pickle
 
-from queue import Queue
-from yamc.utils import Map, randomString
+from collections import deque
+from yamc.utils import Record, backoff_delay
 from yamc import WorkerComponent
+from .backlog import Backlog
 
 
 class HealthCheckException(Exception):
     pass
 
 
+class BatchQueue:
+    """
+    Bounded queue of writer items that releases items in batches. A batch is released as soon as
+    `batch_size` items are available or when the oldest item in the queue waited for `linger`
+    seconds. The queue signals backpressure when its size reaches the high watermark and
+    releases it when the size drops to the low watermark.
+
+    When the `key` function is set, items with the same key are never released in two batches
+    that are in flight at the same time; a batch must be released by `release` once it is written.
+    """
+
+    def __init__(self, capacity, high_watermark, low_watermark, key=None):
+        self.capacity = capacity
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.key = key
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.backpressure = False
+        # keys of items in batches that are in flight
+        self.in_flight = {}
+        # the numbers of queued items by their keys and of queued items with keys in flight
+        self.queued = {}
+        self.blocked = 0
+
+    def put(self, item):
+        """
+        Adds the item to the queue. Returns False when the queue is full or under backpressure.
+        """
+        with self.cond:
+            if self.backpressure or len(self.items) >= self.capacity:
+                return False
+            self.items.append((time.time(), item))
+            if self.key is not None:
+                k = self.key(item)
+                self.queued[k] = self.queued.get(k, 0) + 1
+                if k in self.in_flight:
+                    self.blocked += 1
+            if len(self.items) >= self.high_watermark:
+                self.backpressure = True
+            self.cond.notify_all()
+            return True
+
+    def get_batch(self, batch_size, linger, exit_event=None):
+        """
+        Waits until `batch_size` items are available or the oldest item waited for `linger` seconds
+        and returns the batch. It returns an empty batch when no item is available for `linger`
+        seconds so that the caller can process the backlog, or when the `exit_event` is set.
+        """
+        deadline = time.time() + linger
+        with self.cond:
+            while exit_event is None or not exit_event.is_set():
+                count, oldest = self._available()
+                if count >= batch_size:
+                    break
+                if count > 0:
+                    timeout = linger - (time.time() - oldest)
+                else:
+                    timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                # wait in short intervals to check the exit event
+                self.cond.wait(min(timeout, 1))
+            if (exit_event is not None and exit_event.is_set()) or count == 0:
+                return []
+            return self._take(min(batch_size, count))
+
+    def _available(self):
+        """
+        Returns the number of items that can be released and the time of the oldest item in
+        the queue.
+        """
+        count = len(self.items) - self.blocked
+        return count, self.items[0][0] if count > 0 else None
+
+    def _take(self, batch_size):
+        batch = []
+        if len(self.in_flight) == 0:
+            while len(self.items) > 0 and len(batch) < batch_size:
+                batch.append(self.items.popleft()[1])
+        else:
+            # items with keys in flight are skipped and returned to the front of the queue
+            skipped = []
+            while len(self.items) > 0 and len(batch) < batch_size:
+                t, item = self.items.popleft()
+                if self.key(item) in self.in_flight:
+                    skipped.append((t, item))
+                else:
+                    batch.append(item)
+            self.items.extendleft(reversed(skipped))
+        if self.key is not None:
+            keys = [self.key(item) for item in batch]
+            for k in keys:
+                self.queued[k] -= 1
+                if self.queued[k] == 0:
+                    del self.queued[k]
+            for k in keys:
+                self.in_flight[k] = self.in_flight.get(k, 0) + 1
+                if self.in_flight[k] == 1:
+                    self.blocked += self.queued.get(k, 0)
+        if self.backpressure and len(self.items) <= self.low_watermark:
+            self.backpressure = False
+        return batch
+
+    def release(self, batch):
+        """
+        Releases the keys of the batch that is no longer in flight.
+        """
+        if self.key is not None:
+            with self.cond:
+                for item in batch:
+                    k = self.key(item)
+                    self.in_flight[k] -= 1
+                    if self.in_flight[k] == 0:
+                        del self.in_flight[k]
+                        self.blocked -= self.queued.get(k, 0)
+                self.cond.notify_all()
+
+    def drain(self):
+        """
+        Removes and returns all items in the queue.
+        """
+        with self.cond:
+            return self._take(len(self.items))
+
+    def qsize(self):
+        return len(self.items)
+
+
 class Writer(WorkerComponent):
     def __init__(self, config, component_id):
         super().__init__(config, component_id)
@@ -32,20 +159,68 @@ class Writer(WorkerComponent):
             "healthcheck_interval", default=20
         )
         self.batch_size = self.config.value_int("batch_size", default=100)
+
+        # the maximum time an item waits in the queue, the write_interval is used when not set
+        self.linger = self.config.value("linger", default=None)
+        capacity = self.config.value_int("queue_capacity", default=10000, min=1)
+
+        # the number of batches that can be written concurrently, items of a collector
+        # are never written in two concurrent batches when ordered is set
+        self.max_in_flight = self.config.value_int("max_in_flight", default=1, min=1)
+        self.ordered = self.config.value_bool("ordered", default=True)
+        self.queue = BatchQueue(
+            capacity,
+            self.config.value_int(
+                "high_watermark", default=max(1, int(capacity * 0.8))
+            ),
+            self.config.value_int("low_watermark", default=int(capacity * 0.5)),
+            key=(lambda x: x.collector_id)
+            if self.max_in_flight > 1 and self.ordered
+            else None,
+        )
+
+        # failed batches are retried in memory before they are written to the backlog
+        self.retry_max_attempts = self.config.value_int(
+            "retry.max_attempts", default=3, min=0
+        )
+        self.retry_initial_delay = self.config.value(
+            "retry.initial_delay", default=1, required=False
+        )
+        self.retry_max_delay = self.config.value(
+            "retry.max_delay", default=30, required=False
+        )
+        self.retry_max_items = self.config.value_int(
+            "retry.max_items", default=capacity, min=0
+        )
+        # batches to retry as tuples (time, attempt, batch)
+        self.retries = deque()
+        self.retry_items = 0
+        self.retry_lock = threading.Lock()
+
+        # items that could not be queued, they are written to the backlog in blocks
+        self.spilled = []
+        self.spill_lock = threading.Lock()
+
         self._is_healthy = False
         self.last_healthcheck = 0
-        self.queue = Queue()
+        self.health_lock = threading.Lock()
         self.backlog = Backlog(self, config)
         self.thread = None
-        self.write_event = threading.Event()
 
     def healthcheck(self):
         pass
 
+    def destroy(self):
+        super().destroy()
+        self.flush_spilled()
+        self.backlog.close()
+
     def is_healthy(self):
         if (
             not self._is_healthy
             and time.time() - self.last_healthcheck > self.healthcheck_interval
+            # only one thread runs the healthcheck, other threads use the current state
+            and self.health_lock.acquire(blocking=False)
         ):
             try:
                 self.last_healthcheck = time.time()
@@ -56,76 +231,212 @@ class Writer(WorkerComponent):
                 self.log.error("The healthcheck failed on %s" % (str(e)))
                 self.log.info("The backlog size is %d." % (self.backlog.size()))
                 self._is_healthy = False
+            finally:
+                self.health_lock.release()
         return self._is_healthy
 
     def write(self, collector_id, data, writer_config):
         """
         Non-blocking write operation. This method is called from a collector and must be non-blocking
-        so that the collector can process collecting of measurements
+        so that the collector can process collecting of measurements. It returns False when the item
+        could not be queued due to the writer's state or the queue's backpressure and was spilled
+        to the backlog instead.
         """
-        _data = Map(collector_id=collector_id, data=data, writer_config=writer_config)
+        _data = Record(
+            collector_id=collector_id, data=data, writer_config=writer_config
+        )
         if self.is_healthy():
-            self.queue.put(_data)
-            if self.write_interval == 0:
-                self.write_event.set()
-        else:
-            self.backlog.put([_data])
+            if self.queue.put(_data):
+                return True
+            self.log.debug(
+                "The writer's queue is under backpressure, queue-size=%d. The item will be stored in the backlog."
+                % self.queue.qsize()
+            )
+        self.spill(_data)
+        return False
+
+    def spill(self, item):
+        """
+        Adds the item to the items for the backlog. The items are written to the backlog as
+        a single block by the writer's thread or when there are `batch_size` items.
+        """
+        with self.spill_lock:
+            self.spilled.append(item)
+            if len(self.spilled) < self.batch_size:
+                return
+            items, self.spilled = self.spilled, []
+        self.backlog.put(items)
+
+    def flush_spilled(self):
+        """
+        Writes the spilled items to the backlog.
+        """
+        with self.spill_lock:
+            items, self.spilled = self.spilled, []
+        if len(items) > 0:
+            self.backlog.put(items)
 
     def do_write(self, data):
         """
-        Abstract method to write data to a desintation writer
+        Abstract method to write data to a desintation writer. The method is called from
+        several threads concurrently when `max_in_flight` is greater than 1.
         """
         pass
 
+    def write_batch(self, batch, attempt=0):
+        """
+        Writes the batch. When the batch fails due to the writer's problem, the batch is retried
+        in memory; when the retry budget is exhausted, the writer becomes unhealthy and the batch
+        is stored in the backlog. Other batches in flight are not affected.
+        """
+        retry = False
+        try:
+            self.log.info(
+                "Writing the batch, batch-size=%d, queue-size=%d."
+                % (len(batch), self.queue.qsize())
+            )
+            if not self.args.test:
+                self.do_write(batch)
+            else:
+                self.log.info(
+                    "Running in test mode, the writing operation is disabled."
+                )
+        except HealthCheckException as e:
+            retry = self.retry(batch, attempt, e)
+        except Exception as e:
+            self.log.error(
+                "Cannot write the batch. It will be discarded due to the following error: %s"
+                % (str(e)),
+                exc_info=self.args.debug or self.args.trace,
+            )
+        finally:
+            # the batch being retried remains in flight so that the order of items is kept
+            if not retry:
+                self.queue.release(batch)
+
+    def retry(self, batch, attempt, e):
+        """
+        Schedules the failed batch for the next attempt. Returns False when the retry budget or
+        the memory bound is exhausted; the writer then becomes unhealthy and the batch is stored
+        in the backlog.
+        """
+        with self.retry_lock:
+            if (
+                attempt < self.retry_max_attempts
+                and self.retry_items + len(batch) <= self.retry_max_items
+            ):
+                delay = backoff_delay(
+                    attempt, self.retry_initial_delay, self.retry_max_delay
+                )
+                self.retries.append((time.time() + delay, attempt + 1, batch))
+                self.retry_items += len(batch)
+                self.log.warning(
+                    "Cannot write the batch due to writer's problem: %s. The batch will be retried in %.1f seconds, attempt %d of %d."
+                    % (str(e), delay, attempt + 1, self.retry_max_attempts)
+                )
+                return True
+        self.log.error(
+            "Cannot write the batch due to writer's problem: %s. The batch will be stored in the backlog."
+            % (str(e)),
+            exc_info=self.args.debug or self.args.trace,
+        )
+        self._is_healthy = False
+        self.backlog.put(batch)
+        return False
+
+    def next_retry(self):
+        """
+        Returns the next batch to retry as a tuple (time, attempt, batch). When the batch is
+        not due yet, the time of the retry is returned with the batch set to None.
+        """
+        with self.retry_lock:
+            if len(self.retries) == 0:
+                return None
+            t, attempt, batch = self.retries[0]
+            if t > time.time():
+                return t, attempt, None
+            self.retries.popleft()
+            self.retry_items -= len(batch)
+            return t, attempt, batch
+
+    def spill_retries(self):
+        """
+        Stores all batches waiting for retry in the backlog.
+        """
+        with self.retry_lock:
+            retries, self.retries, self.retry_items = self.retries, deque(), 0
+        if len(retries) > 0:
+            self.log.info(
+                "Storing %d batches waiting for retry in the backlog." % len(retries)
+            )
+            for t, attempt, batch in retries:
+                self.backlog.put(batch)
+                self.queue.release(batch)
+
+    def process_queue(self, exit_event):
+        """
+        Waits for the next batch in the queue and writes it. Batches waiting for retry are
+        written first. It does not take any batch while the writer is unhealthy.
+        """
+        if self.is_healthy():
+            retry = self.next_retry()
+            if retry is not None:
+                t, attempt, batch = retry
+                if batch is not None:
+                    self.write_batch(batch, attempt)
+                else:
+                    exit_event.wait(max(0, min(t - time.time(), 1)))
+                return
+            batch = self.queue.get_batch(
+                self.batch_size,
+                self.write_interval if self.linger is None else self.linger,
+                exit_event,
+            )
+            if len(batch) > 0:
+                self.write_batch(batch)
+        else:
+            self.spill_retries()
+            exit_event.wait(1)
+
+    def batch_worker(self, exit_event):
+        """
+        Worker method of additional threads that write batches concurrently with the main thread.
+        """
+        while not exit_event.is_set():
+            self.process_queue(exit_event)
+
     def worker(self, exit_event):
         """
         Thread worker method
         """
+        threads = []
+        for i in range(self.max_in_flight - 1):
+            threads.append(
+                threading.Thread(
+                    target=self.batch_worker, args=(exit_event,), daemon=True
+                )
+            )
+            threads[-1].start()
 
-        def _process_qeue():
-            if self.is_healthy() and self.queue.qsize() > 0:
-                # create the batch
-                batch = []
-                while self.queue.qsize() > 0 and len(batch) < self.batch_size:
-                    batch.append(self.queue.get())
-                    self.queue.task_done()
-
-                # write the batch
-                try:
-                    self.log.info(
-                        "Writing the batch, batch-size=%d, queue-size=%d."
-                        % (len(batch), self.queue.qsize())
-                    )
-                    if not self.args.test:
-                        self.do_write(batch)
-                    else:
-                        self.log.info(
-                            "Running in test mode, the writing operation is disabled."
-                        )
-                except HealthCheckException as e:
-                    self.log.error(
-                        "Cannot write the batch due to writer's problem: %s. The batch will be stored in the backlog."
-                        % (str(e)),
-                        exc_info=self.args.debug or self.args.trace,
-                    )
-                    self._is_healthy = False
-                    self.backlog.put(batch)
-                except Exception as e:
-                    self.log.error(
-                        "Cannot write the batch. It will be discarded due to the following error: %s"
-                        % (str(e)),
-                        exc_info=self.args.debug or self.args.trace,
-                    )
-
+        # only the main thread processes the backlog
         while not exit_event.is_set():
-            _process_qeue()
-            if self.is_healthy():
+            self.process_queue(exit_event)
+            self.flush_spilled()
+            if self.is_healthy() and len(self.retries) == 0:
                 self.backlog.process()
-            exit_event.wait(self.write_interval)
+            self.backlog.sync()
+
+        for t in threads:
+            t.join()
+        self.spill_retries()
+        self.flush_spilled()
 
         # process all remaining items in the queue if possible
         self.log.info("Ending the writer thread .")
-        _process_qeue()
+        while self.is_healthy() and self.queue.qsize() > 0:
+            self.write_batch(self.queue.get_batch(self.batch_size, 0))
+            # there is no time to retry when the writer is ending
+            self.spill_retries()
 
         # write unprocessed items to the backlog
         if self.queue.qsize() > 0:
@@ -133,99 +444,6 @@ class Writer(WorkerComponent):
                 "There are %d unprocessed items in the queue of the writer. Writing them all to the backlog."
                 % (self.queue.qsize())
             )
-            batch = []
-            while self.queue.qsize() > 0:
-                batch.append(self.queue.get())
-                self.queue.task_done()
-            self.backlog.put(batch)
+            self.backlog.put(self.queue.drain())
 
         self.log.info("The writer thread ended.")
-
-
-class Backlog:
-    def __init__(self, writer, config):
-        self.writer = writer
-        self.config = config
-        self.log = writer.log
-        self.backlog_dir = config.get_dir_path(
-            config.data_dir + "/backlog/" + self.writer.component_id
-        )
-        os.makedirs(self.backlog_dir, exist_ok=True)
-        self.refresh()
-
-    def refresh(self):
-        files = filter(
-            lambda x: os.path.isfile(os.path.join(self.backlog_dir, x))
-            and re.match("items_[a-zA-Z0-9]+.data$", x),
-            os.listdir(self.backlog_dir),
-        )
-        files = [f for f in files]
-        files.sort(key=lambda x: os.path.getmtime(os.path.join(self.backlog_dir, x)))
-        self.all_files = files
-
-    def put(self, items):
-        if self.writer.args.test:
-            self.log.info("Running in test mode, the backlog item will not be created")
-        else:
-            file = "items_%s.data" % randomString()
-            with open(os.path.join(self.backlog_dir, file), "wb") as f:
-                pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
-            self.all_files.append(file)
-            self.log.debug(
-                "Writing data to the writer's backlog. The backlog size is %d."
-                % (self.size())
-            )
-
-    def peek(self, size):
-        files = self.all_files[: min(size, len(self.all_files))]
-        data = []
-        for file in files:
-            with open(os.path.join(self.backlog_dir, file), "rb") as f:
-                data += pickle.load(f)
-        return files, data
-
-    def remove(self, files):
-        if not self.writer.args.test:
-            for file in files:
-                os.remove(os.path.join(self.backlog_dir, file))
-        else:
-            self.log.info(
-                "Running in test mode, removing of backlog files is disabled."
-            )
-        self.all_files = [x for x in self.all_files if x not in files]
-        self.log.debug(
-            "Removing data from the writer's backlog. The backlog size is %s."
-            % (self.size())
-        )
-
-    def size(self):
-        return len(self.all_files)
-
-    def process(self):
-        if self.size() > 0:
-            self.log.info(
-                "There are %d items in the backlog. Writing items in batches of %d..."
-                % (self.size(), self.writer.batch_size)
-            )
-            while self.size() > 0:
-                batch_files, batch = self.peek(self.writer.batch_size)
-                try:
-                    if not self.writer.args.test:
-                        self.writer.do_write(batch)
-                    else:
-                        self.log.info(
-                            "Running in test mode, writing of backlog files is disabled (the backlog will be removed from memory only)."
-                        )
-                    self.remove(batch_files)
-                except Exception as e:
-                    self.log.error(
-                        "Cannot write item from the writer's backlog due to: %s"
-                        % (str(e)),
-                        exc_info=self.writer.args.debug or self.writer.args.trace,
-                    )
-                    self.writer._is_healthy = False
-                    break
-            self.log.info(
-                "The processing of the backlog finished. The backlog size is %s."
-                % self.size()
-            )